@@ -1,7 +1,23 @@
 import sys
 import os
+import io
+import csv
 import tkinter
 import re
+import mmap
+import struct
+import threading
+import multiprocessing
+import math
+import time
+import json
+import atexit
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heapify, heappush, heappop, nsmallest
+from itertools import count, islice, repeat
+from collections import Counter, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from tkinter import StringVar, Entry, Frame, Listbox, Scrollbar
@@ -21,9 +37,1511 @@ def autoscroll(sbar, first, last):
     sbar.set(first, last)
 
 
+def _top_k_by_prefix(ranked, max_length, k):
+    """Map every prefix of up to max_length characters to the values of its first k (key, value) pairs in ranked."""
+    table = {}
+    for key, value in ranked:
+        for length in range(min(len(key), max_length) + 1):
+            values = table.get(key[:length])
+            if values is None:
+                table[key[:length]] = [value]
+            elif len(values) < k:
+                values.append(value)
+    return table
+
+
+def _iter_ranked(indices, rank_key=None):
+    """Yield indices in order of rank_key (of the indices themselves when None), sorting lazily with a heap."""
+    if rank_key is None:
+        heap = list(indices)
+        heapify(heap)
+        while heap:
+            yield heappop(heap)
+    else:
+        heap = [(rank_key(index), index) for index in indices]
+        heapify(heap)
+        while heap:
+            yield heappop(heap)[1]
+
+
+class Lazy_Results(object):
+    """Sequence over an iterator of results, pulling them only as far as they are indexed.
+
+    Truth testing pulls a single result and slicing only up to its stop, while
+    len() pulls everything. Pulling is locked, so results computed on a worker
+    thread can be read from the Tk thread. on_pull, when given, is called with
+    the list of the results each pull loads.
+    """
+
+    def __init__(self, iterable, on_pull=None):
+        self._iterator = iter(iterable)
+        self._items = []
+        self._lock = threading.Lock()
+        self._on_pull = on_pull
+
+    def _added_since(self, start):
+        # Taken under the lock and reported after it, so on_pull may take locks of its own
+        return self._items[start:] if self._on_pull is not None else None
+
+    def pull(self, count):
+        """Load results until count are available and return how many there are, at most count."""
+        if count > len(self._items) and self._iterator is not None:
+            added = None
+            with self._lock:
+                if self._iterator is not None:
+                    start = len(self._items)
+                    self._items.extend(islice(self._iterator, count - len(self._items)))
+                    if len(self._items) < count:
+                        self._iterator = None
+                    added = self._added_since(start)
+            if added:
+                self._on_pull(added)
+        return min(count, len(self._items))
+
+    @property
+    def exhausted(self):
+        return self._iterator is None
+
+    @property
+    def loaded(self):
+        return len(self._items)
+
+    def _pull_all(self):
+        if self._iterator is not None:
+            added = None
+            with self._lock:
+                if self._iterator is not None:
+                    start = len(self._items)
+                    self._items.extend(self._iterator)
+                    self._iterator = None
+                    added = self._added_since(start)
+            if added:
+                self._on_pull(added)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.stop is None or index.stop < 0 or (index.start or 0) < 0:
+                self._pull_all()
+            else:
+                self.pull(index.stop)
+        elif index < 0:
+            self._pull_all()
+        else:
+            self.pull(index + 1)
+        return self._items[index]
+
+    def __bool__(self):
+        return self.pull(1) > 0
+
+    def __len__(self):
+        self._pull_all()
+        return len(self._items)
+
+    def __iter__(self):
+        i = 0
+        while self.pull(i + 1) > i:
+            yield self._items[i]
+            i += 1
+
+
+def top_completions(autocomplete_function, entry_data, k=None):
+    """Return the first k completions of entry_data, through the complete method of engines that have one."""
+    complete = getattr(autocomplete_function, "complete", None)
+    if complete is not None:
+        return complete(entry_data, k)
+    return autocomplete_function(entry_data)[:k]
+
+
+class _Sorted_Index(object):
+    """Completion shared by Prefix_Index and Mmap_Index, over items sorted by (folded) key.
+
+    Subclasses give the range of a prefix with lookup_range, and hand out the
+    completions as handles: _handles(lo, hi) for a range, _cached_handles(key)
+    for the precomputed top completions, _rank_key to order handles and _item to
+    turn one into its item.
+    """
+
+    def _fold(self, text):
+        if self._ignorecase:
+            return text.casefold()
+        return text
+
+    @property
+    def ignorecase(self):
+        return self._ignorecase
+
+    def complete(self, prefix, k=None):
+        return self._complete_range(self._fold(prefix), None, k)
+
+    def iter_matches(self, prefix):
+        """Yield the completions of prefix in the order of complete, ranking them only as they are pulled.
+
+        Short prefixes start with their precomputed top completions, so the range
+        is only ranked if more than those are pulled.
+        """
+        key = self._fold(prefix)
+        lo, hi = self.lookup_range(prefix)
+
+        cached = ()
+        if self._cache_prefix_length > 0 and len(key) <= self._cache_prefix_length:
+            cached = self._cached_handles(key)
+            for handle in cached:
+                yield self._item(handle)
+            if len(cached) >= hi - lo:
+                return
+
+        # The cached completions are the first of the ranking, which breaks every tie
+        for handle in islice(_iter_ranked(self._handles(lo, hi), self._rank_key()), len(cached), None):
+            yield self._item(handle)
+
+    def complete_many(self, prefixes, k=None):
+        """Yield (prefix, completions) for each prefix, in key order.
+
+        A prefix extending an earlier one is only searched for within that one's range.
+        """
+        stack = []
+        for prefix in sorted(prefixes, key=self._fold):
+            key = self._fold(prefix)
+            while stack and not key.startswith(stack[-1][0]):
+                stack.pop()
+
+            within = stack[-1][1] if stack else (0, len(self))
+            found = self.lookup_range(prefix, *within)
+            stack.append((key, found))
+
+            yield prefix, self._complete_range(key, found, k)
+
+    def _complete_range(self, key, found, k):
+        if self._cache_prefix_length > 0 and k is not None and k <= self._cache_k and \
+                len(key) <= self._cache_prefix_length:
+            return [self._item(handle) for handle in self._cached_handles(key)[:k]]
+
+        if found is None:
+            found = self.lookup_range(key)
+
+        # Keys sharing the prefix are contiguous in the sorted array, but callers expect file or score order
+        handles = self._handles(*found)
+        rank_key = self._rank_key()
+
+        if k is None:
+            handles = sorted(handles, key=rank_key)
+        else:
+            handles = nsmallest(k, handles, key=rank_key)
+        return [self._item(handle) for handle in handles]
+
+    def __call__(self, prefix):
+        return self.complete(prefix)
+
+    def narrow(self, prefix, candidates):
+        """Filter the completions of a shorter prefix down to those of prefix."""
+        key = self._fold(prefix)
+        return [item for item in candidates if self._fold(item).startswith(key)]
+
+
+class Prefix_Index(_Sorted_Index):
+    """Sorted array of (optionally case-folded) keys answering prefix queries with bisect.
+
+    Completions come in file order, or best score first when scores (parallel to
+    list_of_items) are given. With cache_prefix_length, the top cache_k completions
+    of every prefix up to that length are precomputed and answered by a dict lookup.
+    """
+
+    def __init__(self, list_of_items, ignorecase=True, scores=None, cache_prefix_length=0, cache_k=10):
+        self.list_of_items = list_of_items
+        self._ignorecase = ignorecase
+        self._scores = None if scores is None else list(scores)
+
+        keys = [self._fold(item) for item in list_of_items]
+        self._positions = sorted(range(len(keys)), key=keys.__getitem__)
+        self._keys = [keys[position] for position in self._positions]
+
+        self._cache_prefix_length = cache_prefix_length
+        self._cache_k = cache_k
+        if cache_prefix_length > 0:
+            ranked = sorted(range(len(keys)), key=self._rank_key())
+            self._top_k = _top_k_by_prefix(((keys[position], position) for position in ranked),
+                                           cache_prefix_length, cache_k)
+        else:
+            self._top_k = None
+
+    def _rank_key(self):
+        if self._scores is None:
+            return None
+        scores = self._scores
+        return lambda position: (-scores[position], position)
+
+    def _handles(self, lo, hi):
+        return self._positions[lo:hi]
+
+    def _cached_handles(self, key):
+        return self._top_k.get(key, ())
+
+    def _item(self, position):
+        return self.list_of_items[position]
+
+    def lookup_range(self, prefix, lo=0, hi=None):
+        """Return the range of sorted keys starting with prefix, searching only within lo:hi."""
+        key = self._fold(prefix)
+        if hi is None:
+            hi = len(self._keys)
+
+        lo = bisect_left(self._keys, key, lo, hi)
+        hi = bisect_left(self._keys, key + u"\U0010ffff", lo, hi)
+        return lo, hi
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class Substring_Search(object):
+    """Substring matching through an inverted index of the character 1-, 2- and 3-grams of case-folded keys.
+
+    A fragment is only checked against the items holding its rarest n-gram of
+    up to three characters, which for shorter fragments is the fragment itself.
+    Postings are kept in ranking order (file order, or best score first), so
+    matches come out ranked and a lookup for k of them stops after the k-th.
+    """
+
+    def __init__(self, list_of_items, ignorecase=True, scores=None):
+        self.list_of_items = list_of_items
+        self._ignorecase = ignorecase
+        self._scores = None if scores is None else list(scores)
+
+        self._keys = [self._fold(item) for item in list_of_items]
+
+        if self._scores is None:
+            ranked = range(len(self._keys))
+        else:
+            ranked = sorted(range(len(self._keys)), key=lambda position: (-self._scores[position], position))
+        self._ranked = array("I", ranked)
+
+        postings = {}
+        keys = self._keys
+        for position in self._ranked:
+            key = keys[position]
+            for gram in {key[i:i + n] for n in (1, 2, 3) for i in range(len(key) - n + 1)}:
+                try:
+                    postings[gram].append(position)
+                except KeyError:
+                    postings[gram] = [position]
+
+        # Lists grow faster while indexing; arrays take a quarter of the space afterwards
+        self._postings = dict((gram, array("I", positions)) for gram, positions in postings.items())
+
+    def _fold(self, text):
+        if self._ignorecase:
+            return text.casefold()
+        return text
+
+    @property
+    def ignorecase(self):
+        return self._ignorecase
+
+    def _candidates(self, key):
+        if not key:
+            return self._ranked
+
+        n = min(len(key), 3)
+        rarest = None
+        for i in range(len(key) - n + 1):
+            postings = self._postings.get(key[i:i + n])
+            if postings is None:
+                return ()
+            if rarest is None or len(postings) < len(rarest):
+                rarest = postings
+        return rarest
+
+    def iter_matches(self, fragment):
+        """Yield the items containing fragment in the order of complete, scanning only as far as pulled."""
+        key = self._fold(fragment)
+        keys = self._keys
+        for position in self._candidates(key):
+            if key in keys[position]:
+                yield self.list_of_items[position]
+
+    def complete(self, fragment, k=None):
+        return list(islice(self.iter_matches(fragment), k))
+
+    def __call__(self, fragment):
+        return self.complete(fragment)
+
+    def narrow(self, fragment, candidates):
+        key = self._fold(fragment)
+        return [item for item in candidates if key in self._fold(item)]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class _Trie_Node(object):
+    # Lists rather than dicts, and None for the many leaves, keep the per-node overhead low:
+    # children is a list of nodes told apart by the first character of their label, and
+    # entries a flat tuple of item, score, insertion order triples
+    __slots__ = ("label", "children", "max_score", "min_order", "entries")
+
+    def __init__(self, label=u"", max_score=None, min_order=None):
+        self.label = label
+        self.children = None
+        self.max_score = max_score
+        self.min_order = min_order
+        self.entries = None
+
+    def child(self, character):
+        if self.children is not None:
+            for child in self.children:
+                if child.label[0] == character:
+                    return child
+        return None
+
+    def replace_child(self, old, new):
+        self.children[self.children.index(old)] = new
+
+    def add_child(self, child):
+        if self.children is None:
+            self.children = [child]
+        else:
+            self.children.append(child)
+
+
+def _common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+_WALK, _MATCH, _ITEM = range(3)
+
+
+class _Radix_Trie(object):
+    """Completion shared by Trie_Completer and Packed_Trie, over a path-compressed trie of (folded) keys.
+
+    Subclasses give the root node as _root and describe a node through
+    _label(node), _child(node, character), _children(node), _entries(node) as
+    (item, score, order) triples, and _max_score(node) and _min_order(node) over
+    its subtree, with a max_score of None for an empty trie.
+    """
+
+    def _fold(self, text):
+        if self._ignorecase:
+            return text.casefold()
+        return text
+
+    @property
+    def ignorecase(self):
+        return self._ignorecase
+
+    def _find(self, prefix):
+        found = self._descend(self._root, u"", self._fold(prefix))
+        return found and found[0]
+
+    def _descend(self, node, path, key):
+        """Return (node, path) for the subtree holding the completions of key, walking down from node.
+
+        path is the key of node itself, which key must extend; the returned path may
+        be longer than key when key ends in the middle of an edge.
+        """
+        if path.startswith(key):
+            return node, path
+        if not key.startswith(path):
+            return None
+
+        rest = key[len(path):]
+        while rest:
+            child = self._child(node, rest[0])
+            if child is None:
+                return None
+
+            label = self._label(child)
+            if label.startswith(rest):
+                return child, key + label[len(rest):]
+            if not rest.startswith(label):
+                return None
+
+            rest = rest[len(label):]
+            node = child
+
+        return node, key
+
+    def iter_complete(self, prefix):
+        """Yield (item, score) pairs extending prefix, best score first."""
+        node = self._find(prefix)
+        if node is None:
+            return ()
+        return self._iter_best_first([node])
+
+    def complete_many(self, prefixes, k=None):
+        """Yield (prefix, completions) for each prefix, in key order.
+
+        A prefix extending an earlier one resumes the walk down from that one's node.
+        """
+        stack = []
+        for prefix in sorted(prefixes, key=self._fold):
+            key = self._fold(prefix)
+            while stack and not key.startswith(stack[-1][0]):
+                stack.pop()
+
+            if not stack:
+                found = self._descend(self._root, u"", key)
+            elif stack[-1][1] is None:
+                found = None
+            else:
+                found = self._descend(stack[-1][1][0], stack[-1][1][1], key)
+            stack.append((key, found))
+
+            results = []
+            if found is not None:
+                for item, score in self._iter_best_first([found[0]]):
+                    if k is not None and len(results) >= k:
+                        break
+                    results.append(item)
+            yield prefix, results
+
+    def _iter_best_first(self, nodes):
+        # A node is keyed by the best score and earliest order in its subtree, so it
+        # comes off the heap before any of its items
+        max_score, min_order = self._max_score, self._min_order
+        tiebreak = count()
+        heap = [(-max_score(node), min_order(node), next(tiebreak), node, None)
+                for node in nodes if max_score(node) is not None]
+        heap.sort()
+
+        while heap:
+            negative_score, order, _, node, item = heappop(heap)
+            if node is None:
+                yield item, -negative_score
+                continue
+
+            for item, score, order in self._entries(node):
+                heappush(heap, (-score, order, next(tiebreak), None, item))
+
+            for child in self._children(node):
+                heappush(heap, (-max_score(child), min_order(child), next(tiebreak), child, None))
+
+    def iter_matches(self, prefix):
+        for item, score in self.iter_complete(prefix):
+            yield item
+
+    def complete(self, prefix, k=None):
+        results = []
+        for item, score in self.iter_complete(prefix):
+            if k is not None and len(results) >= k:
+                break
+            results.append(item)
+        return results
+
+    def iter_fuzzy_complete(self, prefix, max_distance=1, max_rows=None):
+        """Yield (item, distance) for items extending a string within max_distance edits of prefix.
+
+        The trie is walked with a Levenshtein automaton: each step computes one row
+        of the edit distance table against prefix, and branches whose row is all
+        above max_distance are pruned. Items come by distance, then best score first.
+
+        The walk is best-first on (distance, score): the smallest entry of a row
+        bounds the distance of everything below it, so each item is yielded as soon
+        as nothing left on the heap can beat it, and stopping early saves the rest.
+        With max_rows, the walk stops after computing that many rows, and only the
+        matches found by then are yielded.
+        """
+        query = self._fold(prefix)
+        max_score, min_order = self._max_score, self._min_order
+        tiebreak = count()
+
+        # Entries are (distance, -score, order, tiebreak, kind, node or item, row), where kind is
+        # _WALK for a node still to be matched against query, _MATCH for a subtree matched at
+        # distance, and _ITEM for an item
+        heap = []
+        first_row = list(range(len(query) + 1))
+        root = self._root
+        if max_score(root) is None:
+            return
+
+        if first_row[-1] <= max_distance:
+            heappush(heap, (first_row[-1], -max_score(root), min_order(root), next(tiebreak), _MATCH, root, None))
+        if first_row[-1] > 0:
+            heappush(heap, (0, -max_score(root), min_order(root), next(tiebreak), _WALK, root, first_row))
+
+        seen = set()
+        rows = 0
+        while heap:
+            distance, negative_score, order, _, kind, node, parent_row = heappop(heap)
+
+            if kind == _ITEM:
+                if node not in seen:
+                    seen.add(node)
+                    yield node, distance
+
+            elif kind == _MATCH:
+                for item, score, order in self._entries(node):
+                    heappush(heap, (distance, -score, order, next(tiebreak), _ITEM, item, None))
+                for child in self._children(node):
+                    heappush(heap, (distance, -max_score(child), min_order(child), next(tiebreak), _MATCH, child,
+                                    None))
+
+            elif max_rows is None or rows < max_rows:
+                for child in self._children(node):
+                    label = self._label(child)
+                    row = parent_row
+                    best = None
+                    rows += len(label)
+
+                    # A key ending inside the label still completes to the whole child subtree
+                    for character in label:
+                        previous_row = row
+                        left = previous_row[0] + 1
+                        row = [left]
+                        for diagonal, above, query_character in zip(previous_row, previous_row[1:], query):
+                            left = min(above + 1, left + 1, diagonal + (query_character != character))
+                            row.append(left)
+
+                        if best is None or row[-1] < best:
+                            best = row[-1]
+                        if min(row) > max_distance:
+                            break
+
+                    if best <= max_distance:
+                        heappush(heap, (best, -max_score(child), min_order(child), next(tiebreak), _MATCH, child,
+                                        None))
+
+                    # Deeper keys can't match with fewer edits than the smallest entry of the row
+                    bound = min(row)
+                    if bound <= max_distance and bound < best:
+                        heappush(heap, (bound, -max_score(child), min_order(child), next(tiebreak), _WALK, child,
+                                        row))
+
+    def fuzzy_complete(self, prefix, max_distance=1, k=None, max_rows=None):
+        results = []
+        for item, distance in self.iter_fuzzy_complete(prefix, max_distance, max_rows):
+            if k is not None and len(results) >= k:
+                break
+            results.append(item)
+        return results
+
+    def __call__(self, prefix):
+        return self.complete(prefix)
+
+    def narrow(self, prefix, candidates):
+        """Filter the completions of a shorter prefix down to those of prefix, keeping their ranking."""
+        key = self._fold(prefix)
+        return [item for item in candidates if self._fold(item).startswith(key)]
+
+
+class Trie_Completer(_Radix_Trie):
+    """Path-compressed trie returning the k best scored completions of a prefix.
+
+    Every node stores the best score found in its subtree, so a best-first walk
+    can stop after k results without visiting the rest of the subtree. When no
+    scores are given, an item scores the number of times it occurs in list_of_items.
+    Ties come in the order the items were first added.
+
+    Unlike Packed_Trie, items can be added one at a time, at the price of memory:
+    a node object per edge takes several times the space of the item list. For a
+    fixed list, use Packed_Trie.
+    """
+
+    def __init__(self, list_of_items=(), scores=None, ignorecase=True):
+        self._ignorecase = ignorecase
+        self._root = _Trie_Node()
+        self._size = 0
+
+        if scores is None:
+            for item in list_of_items:
+                self.add(item, 1)
+        else:
+            for item, score in zip(list_of_items, scores):
+                self.add(item, score)
+
+    def add(self, item, score=1):
+        """Insert item, adding score to it when it is already present."""
+        key = self._fold(item)
+
+        node = self._root
+        path = [node]
+
+        while key:
+            child = node.child(key[0])
+            if child is None:
+                child = _Trie_Node(key)
+                node.add_child(child)
+                node = child
+                path.append(node)
+                break
+
+            label = child.label
+            common = _common_prefix_length(label, key)
+            if common < len(label):
+                middle = _Trie_Node(label[:common], child.max_score, child.min_order)
+                node.replace_child(child, middle)
+                child.label = label[common:]
+                middle.add_child(child)
+                child = middle
+
+            key = key[common:]
+            node = child
+            path.append(node)
+
+        entries = node.entries or ()
+        for i in range(0, len(entries), 3):
+            if entries[i] == item:
+                score += entries[i + 1]
+                order = entries[i + 2]
+                node.entries = entries[:i] + (item, score, order) + entries[i + 3:]
+                break
+        else:
+            order = self._size
+            self._size += 1
+            node.entries = entries + (item, score, order)
+
+        for node in path:
+            if node.max_score is None or score > node.max_score:
+                node.max_score = score
+            if node.min_order is None or order < node.min_order:
+                node.min_order = order
+
+    @staticmethod
+    def _label(node):
+        return node.label
+
+    @staticmethod
+    def _child(node, character):
+        return node.child(character)
+
+    @staticmethod
+    def _children(node):
+        return node.children or ()
+
+    @staticmethod
+    def _entries(node):
+        entries = node.entries or ()
+        return [entries[i:i + 3] for i in range(0, len(entries), 3)]
+
+    @staticmethod
+    def _max_score(node):
+        return node.max_score
+
+    @staticmethod
+    def _min_order(node):
+        return node.min_order
+
+    def __len__(self):
+        return self._size
+
+
+class Packed_Trie(_Radix_Trie):
+    """Read-only Trie_Completer packed into flat arrays, built from a fixed list of items.
+
+    Nodes are numbered breadth first, so the children of each node are a run of
+    consecutive numbers, and every node is a few array slots: the start of its
+    label in one string of labels, of its children and of its items, and the best
+    score and earliest order in its subtree. It takes less memory than a
+    Prefix_Index over the same items.
+    """
+
+    _root = 0
+
+    def __init__(self, list_of_items, scores=None, ignorecase=True):
+        self._ignorecase = ignorecase
+
+        # Repeated items are merged, adding up their scores, like Trie_Completer.add
+        self._items = []
+        positions = {}
+        item_scores = []
+        for item, score in zip(list_of_items, repeat(1) if scores is None else scores):
+            position = positions.get(item)
+            if position is None:
+                positions[item] = len(self._items)
+                self._items.append(item)
+                item_scores.append(score)
+            else:
+                item_scores[position] += score
+        del positions
+        self._scores = array("d", item_scores)
+        del item_scores
+
+        keys = [self._fold(item) for item in self._items]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        keys = [keys[position] for position in order]
+
+        labels = []
+        first_characters = []
+        self._label_starts = array("I", [0])
+        self._child_starts = array("I")
+        self._entry_starts = array("I", [0])
+        self._entries_column = array("I")
+
+        # A node covers the keys in [lo, hi), which share their characters up to the
+        # end of its label, starting at start; the root has an empty label
+        nodes = deque([(0, len(keys), 0, True)])
+        label_length = 0
+        node_count = 1
+        while nodes:
+            lo, hi, start, root = nodes.popleft()
+            end = start if root else _common_prefix_length(keys[lo], keys[hi - 1])
+            labels.append(keys[lo][start:end] if not root else u"")
+            first_characters.append(u" " if root else keys[lo][start])
+            label_length += end - start
+            self._label_starts.append(label_length)
+
+            while lo < hi and len(keys[lo]) == end:
+                self._entries_column.append(order[lo])
+                lo += 1
+            self._entry_starts.append(len(self._entries_column))
+
+            self._child_starts.append(node_count)
+            while lo < hi:
+                character = keys[lo][end]
+                if ord(character) == sys.maxunicode:
+                    next_lo = hi
+                else:
+                    next_lo = bisect_left(keys, keys[lo][:end] + chr(ord(character) + 1), lo, hi)
+                nodes.append((lo, next_lo, end, False))
+                node_count += 1
+                lo = next_lo
+        self._child_starts.append(node_count)
+
+        self._labels = u"".join(labels)
+        self._first_characters = u"".join(first_characters)
+        del labels, first_characters, keys, order
+
+        # Children come after their parent, so walking back up fills in every subtree
+        self._max_scores = array("d", [0.0]) * node_count
+        self._min_orders = array("I", [0]) * node_count
+        for node in range(node_count - 1, -1, -1):
+            max_score = None
+            min_order = None
+            for position in self._entries_column[self._entry_starts[node]:self._entry_starts[node + 1]]:
+                if max_score is None or self._scores[position] > max_score:
+                    max_score = self._scores[position]
+                if min_order is None or position < min_order:
+                    min_order = position
+            for child in range(self._child_starts[node], self._child_starts[node + 1]):
+                if max_score is None or self._max_scores[child] > max_score:
+                    max_score = self._max_scores[child]
+                if min_order is None or self._min_orders[child] < min_order:
+                    min_order = self._min_orders[child]
+            if max_score is not None:
+                self._max_scores[node] = max_score
+                self._min_orders[node] = min_order
+
+    def _label(self, node):
+        return self._labels[self._label_starts[node]:self._label_starts[node + 1]]
+
+    def _child(self, node, character):
+        child = self._first_characters.find(character, self._child_starts[node], self._child_starts[node + 1])
+        return None if child < 0 else child
+
+    def _children(self, node):
+        return range(self._child_starts[node], self._child_starts[node + 1])
+
+    def _entries(self, node):
+        scores = self._scores
+        items = self._items
+        return [(items[position], scores[position], position)
+                for position in self._entries_column[self._entry_starts[node]:self._entry_starts[node + 1]]]
+
+    def _max_score(self, node):
+        return self._max_scores[node] if self._items else None
+
+    def _min_order(self, node):
+        return self._min_orders[node]
+
+    def __len__(self):
+        return len(self._items)
+
+
+_INDEX_MAGIC = b"TPINDEX1"
+_INDEX_VERSION = 3
+_INDEX_HEADER = struct.Struct("<8sIIQQIIQQQ")
+
+_INDEX_IGNORECASE = 1
+_INDEX_SCORES = 2
+_INDEX_BIG_ENDIAN = 4
+
+
+def _aligned(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _index_layout(count, blob_size, flags):
+    offsets_start = _INDEX_HEADER.size
+    positions_start = offsets_start + 8 * (count + 1)
+    scores_start = _aligned(positions_start + 4 * count)
+    if flags & _INDEX_SCORES:
+        blob_start = scores_start + 8 * count
+    else:
+        blob_start = scores_start
+    return offsets_start, positions_start, scores_start, blob_start, blob_start + blob_size
+
+
+def _cache_layout(start, cache_count, cache_entries, cache_blob_size):
+    entry_offsets_start = _aligned(start)
+    entries_start = entry_offsets_start + 8 * (cache_count + 1)
+    prefix_offsets_start = _aligned(entries_start + 4 * cache_entries)
+    prefix_blob_start = prefix_offsets_start + 8 * (cache_count + 1)
+    return entry_offsets_start, entries_start, prefix_offsets_start, prefix_blob_start, \
+        prefix_blob_start + cache_blob_size
+
+
+def compile_index(list_of_items, filename, scores=None, ignorecase=True, cache_prefix_length=3, cache_k=10):
+    """Write list_of_items as a binary index file that Mmap_Index can open.
+
+    The file holds a header, the blob offsets of the items sorted by (folded) key,
+    their positions in list_of_items, optional float scores and the UTF-8 blob,
+    followed by the top cache_k completions of every prefix up to cache_prefix_length.
+    """
+    list_of_items = list(list_of_items)
+
+    if ignorecase:
+        keys = [item.casefold() for item in list_of_items]
+    else:
+        keys = list_of_items
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    offsets = array("Q", [0])
+    positions = array("I", order)
+    blob = bytearray()
+    for position in order:
+        blob += list_of_items[position].encode("utf-8")
+        offsets.append(len(blob))
+
+    flags = 0
+    if ignorecase:
+        flags |= _INDEX_IGNORECASE
+    if sys.byteorder == "big":
+        flags |= _INDEX_BIG_ENDIAN
+    if scores is not None:
+        flags |= _INDEX_SCORES
+        scores = list(scores)
+        sorted_scores = array("d", [scores[position] for position in order])
+
+    # Cached completions are stored as indexes into the sorted items, in completion order
+    if scores is None:
+        ranked = sorted(range(len(order)), key=order.__getitem__)
+    else:
+        ranked = sorted(range(len(order)), key=lambda i: (-sorted_scores[i], order[i]))
+    top_k = _top_k_by_prefix(((keys[order[i]], i) for i in ranked), cache_prefix_length, cache_k) \
+        if cache_prefix_length > 0 else {}
+
+    entry_offsets = array("Q", [0])
+    entries = array("I")
+    prefix_offsets = array("Q", [0])
+    prefix_blob = bytearray()
+    for prefix in sorted(top_k):
+        entries.extend(top_k[prefix])
+        entry_offsets.append(len(entries))
+        prefix_blob += prefix.encode("utf-8")
+        prefix_offsets.append(len(prefix_blob))
+
+    offsets_start, positions_start, scores_start, blob_start, end = _index_layout(len(order), len(blob), flags)
+    entry_offsets_start, entries_start, prefix_offsets_start, prefix_blob_start, cache_end = \
+        _cache_layout(end, len(top_k), len(entries), len(prefix_blob))
+
+    with open(filename, "wb") as f:
+        f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, flags, len(order), len(blob),
+                                   cache_prefix_length, cache_k, len(top_k), len(entries), len(prefix_blob)))
+        f.write(offsets.tobytes())
+        f.write(positions.tobytes())
+        f.write(b"\0" * (scores_start - positions_start - 4 * len(order)))
+        if scores is not None:
+            f.write(sorted_scores.tobytes())
+        f.write(blob)
+        f.write(b"\0" * (entry_offsets_start - end))
+        f.write(entry_offsets.tobytes())
+        f.write(entries.tobytes())
+        f.write(b"\0" * (prefix_offsets_start - entries_start - 4 * len(entries)))
+        f.write(prefix_offsets.tobytes())
+        f.write(prefix_blob)
+
+
+class Mmap_Index(_Sorted_Index):
+    """Prefix index over a file written by compile_index, queried in place through mmap.
+
+    Only the items that are returned get decoded, so opening the index costs no
+    parsing and the pages are shared between every process that maps the file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, count, blob_size, cache_prefix_length, cache_k, cache_count, cache_entries, \
+            cache_blob_size = _INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError("%r is not a compiled word index" % filename)
+        if bool(flags & _INDEX_BIG_ENDIAN) != (sys.byteorder == "big"):
+            raise ValueError("%r was compiled on a machine with a different byte order" % filename)
+
+        offsets_start, positions_start, scores_start, blob_start, end = _index_layout(count, blob_size, flags)
+
+        view = memoryview(self._mmap)
+        self._offsets = view[offsets_start:positions_start].cast("Q")
+        self._positions = view[positions_start:positions_start + 4 * count].cast("I")
+        if flags & _INDEX_SCORES:
+            self._scores = view[scores_start:blob_start].cast("d")
+        else:
+            self._scores = None
+        self._blob = view[blob_start:end]
+
+        entry_offsets_start, entries_start, prefix_offsets_start, prefix_blob_start, cache_end = \
+            _cache_layout(end, cache_count, cache_entries, cache_blob_size)
+        self._entry_offsets = view[entry_offsets_start:entries_start].cast("Q")
+        self._entries = view[entries_start:entries_start + 4 * cache_entries].cast("I")
+        self._prefix_offsets = view[prefix_offsets_start:prefix_blob_start].cast("Q")
+        self._prefix_blob = view[prefix_blob_start:cache_end]
+
+        self._cache_prefix_length = cache_prefix_length
+        self._cache_k = cache_k
+        self._top_k = None
+
+        self._ignorecase = bool(flags & _INDEX_IGNORECASE)
+        self._count = count
+
+    def _cached_handles(self, key):
+        if self._top_k is None:
+            # Decoding the prefixes is deferred to the first short query, so opening stays free
+            top_k = {}
+            prefix_offsets = self._prefix_offsets
+            for j in range(len(prefix_offsets) - 1):
+                prefix = bytes(self._prefix_blob[prefix_offsets[j]:prefix_offsets[j + 1]]).decode("utf-8")
+                top_k[prefix] = j
+            self._top_k = top_k
+
+        j = self._top_k.get(key)
+        if j is None:
+            return ()
+        return self._entries[self._entry_offsets[j]:self._entry_offsets[j + 1]]
+
+    def item(self, i):
+        """Return the i-th item in key order."""
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def score(self, i):
+        if self._scores is None:
+            return None
+        return self._scores[i]
+
+    def _bisect(self, key, lo, hi):
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self._fold(self.item(middle)) < key:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def lookup_range(self, prefix, lo=0, hi=None):
+        key = self._fold(prefix)
+        if hi is None:
+            hi = self._count
+
+        lo = self._bisect(key, lo, hi)
+        hi = self._bisect(key + u"\U0010ffff", lo, hi)
+        return lo, hi
+
+    def _rank_key(self):
+        # Same file or score order as Prefix_Index
+        if self._scores is None:
+            return self._positions.__getitem__
+        return lambda i: (-self._scores[i], self._positions[i])
+
+    def _handles(self, lo, hi):
+        return range(lo, hi)
+
+    _item = item
+
+    def __len__(self):
+        return self._count
+
+    def __getstate__(self):
+        # Worker processes map the file again rather than receiving a copy of it
+        return self.filename
+
+    def __setstate__(self, filename):
+        self.__init__(filename)
+
+    def close(self):
+        self._offsets.release()
+        self._positions.release()
+        if self._scores is not None:
+            self._scores.release()
+        self._blob.release()
+        self._entry_offsets.release()
+        self._entries.release()
+        self._prefix_offsets.release()
+        self._prefix_blob.release()
+        self._mmap.close()
+
+
+def _complete_sorted(engine, prefixes, k):
+    complete_many = getattr(engine, "complete_many", None)
+    if complete_many is not None:
+        return complete_many(prefixes, k)
+
+    return ((prefix, top_completions(engine, prefix, k)) for prefix in prefixes)
+
+
+_batch_engine = None
+
+
+def _init_batch_worker(engine):
+    # Every worker receives the engine once, not once per chunk
+    global _batch_engine
+    _batch_engine = engine
+
+
+def _complete_chunk(args):
+    prefixes, k = args
+    return list(_complete_sorted(_batch_engine, prefixes, k))
+
+
+def complete_many(engine, prefixes, k=10, processes=1, chunk_size=1000):
+    """Yield (prefix, completions) for each distinct prefix, in sorted order, as they are computed.
+
+    Sorting puts prefixes sharing a stem next to each other, so engines with a
+    complete_many method search each one from where its stem was found. With
+    processes other than 1, contiguous chunks of chunk_size prefixes are fanned out
+    to a pool of workers (all cores when None); a Cached_Completer is unwrapped
+    first, since its cache would not be shared with them anyway.
+    """
+    prefixes = sorted(set(prefixes), key=lambda prefix: (prefix.casefold(), prefix))
+
+    if processes == 1 or len(prefixes) <= chunk_size:
+        for result in _complete_sorted(engine, prefixes, k):
+            yield result
+        return
+
+    if isinstance(engine, Cached_Completer):
+        engine = engine.autocomplete_function
+
+    chunks = [(prefixes[i:i + chunk_size], k) for i in range(0, len(prefixes), chunk_size)]
+    pool = multiprocessing.Pool(processes, _init_batch_worker, (engine,))
+    try:
+        for results in pool.imap(_complete_chunk, chunks):
+            for result in results:
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Cached_Completer(object):
+    """LRU cache of the results of an autocomplete function, bounded by entries and optionally by bytes.
+
+    iter_matches caches a Lazy_Results, whose size grows by the results it loads
+    as it is read. Any other attribute, such as narrow, is looked up on the
+    wrapped function.
+    """
+
+    def __init__(self, autocomplete_function, max_entries=1024, max_bytes=None):
+        self.autocomplete_function = autocomplete_function
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._results = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["autocomplete_function"], name)
+
+    @staticmethod
+    def _size(values):
+        if isinstance(values, Lazy_Results):
+            values = values[:values.loaded]
+        return sys.getsizeof(values) + sum(sys.getsizeof(item) for item in values)
+
+    def _store(self, key, values, size):
+        # Called with the lock held
+        if key in self._results:
+            self._bytes -= self._results[key][1]
+        self._results[key] = (values, size)
+        self._bytes += size
+
+        while self._results and (len(self._results) > self.max_entries or
+                                 self.max_bytes is not None and self._bytes > self.max_bytes):
+            evicted_values, evicted_size = self._results.popitem(last=False)[1]
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _get(self, key, compute):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key][0]
+            self.misses += 1
+
+        values = compute()
+        size = self._size(values) if self.max_bytes is not None else 0
+
+        with self._lock:
+            if key not in self._results:
+                self._store(key, values, size)
+
+        return values
+
+    def __call__(self, entry_data):
+        return self._get((entry_data, None), lambda: self.autocomplete_function(entry_data))
+
+    def complete(self, entry_data, k=None):
+        return self._get((entry_data, k), lambda: top_completions(self.autocomplete_function, entry_data, k))
+
+    def iter_matches(self, entry_data):
+        iter_matches = getattr(self.autocomplete_function, "iter_matches", None)
+        if iter_matches is None:
+            return iter(self(entry_data))
+        key = (entry_data, "iter")
+
+        def compute():
+            if self.max_bytes is None:
+                return Lazy_Results(iter_matches(entry_data))
+            values = Lazy_Results(iter_matches(entry_data), lambda items: self._grow(key, values, items))
+            return values
+
+        return iter(self._get(key, compute))
+
+    def _grow(self, key, values, items):
+        # Counts the results a cached Lazy_Results just loaded, a list slot and the item each
+        size = sum(8 + sys.getsizeof(item) for item in items)
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] is values:
+                self._store(key, values, entry[1] + size)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._results), "bytes": self._bytes}
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._bytes = 0
+
+
+class Usage_Model(object):
+    """Decaying counts of the words a user accepts or types, persisted to an append-only log.
+
+    A count halves every half_life recorded words. Rather than decaying every
+    count, each new one is added scaled up by the decay so far, which keeps the
+    order; the counts are only divided back down, in one pass, when the scale
+    grows too large. They live in a Trie_Completer, so an update costs the length
+    of the word.
+
+    With a filename, the log is replayed on creation, and recorded words are
+    appended to it and compacted into a snapshot by a background thread, every
+    flush_interval seconds.
+    """
+
+    MAX_SCALE = 1e100
+
+    def __init__(self, filename=None, half_life=1000, min_count=0.05, flush_interval=5.0, ignorecase=True):
+        self.filename = filename
+        self.min_count = min_count
+        self.flush_interval = flush_interval
+        self._ignorecase = ignorecase
+        self._growth = 2.0 ** (1.0 / half_life)
+
+        self._scale = 1.0
+        self._weights = {}
+        self._trie = Trie_Completer(ignorecase=ignorecase)
+        self._lock = threading.Lock()
+
+        # Log lines waiting for the writer thread, and the number already in the file
+        self._pending = []
+        self._log_lines = 0
+        self._writer = None
+        self._stop = threading.Event()
+
+        if filename is not None:
+            if os.path.exists(filename):
+                self._replay(filename)
+            atexit.register(self.close)
+
+    def _replay(self, filename):
+        with io.open(filename, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    kind, word, amount = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+
+                if kind == "+":
+                    self._add(word, amount)
+                else:
+                    self._set(word, amount)
+                self._log_lines += 1
+
+    def _add(self, word, amount):
+        self._scale *= self._growth
+        if self._scale > self.MAX_SCALE:
+            self._rescale()
+
+        weight = amount * self._scale
+        self._weights[word] = self._weights.get(word, 0.0) + weight
+        self._trie.add(word, weight)
+
+    def _set(self, word, count):
+        # Only snapshots set counts, and each word appears once in them
+        weight = count * self._scale
+        self._weights[word] = self._weights.get(word, 0.0) + weight
+        self._trie.add(word, weight)
+
+    def _rescale(self):
+        # Forgotten words are dropped while every count is touched anyway
+        scale = self._scale
+        self._weights = dict((word, weight / scale) for word, weight in self._weights.items()
+                             if weight / scale >= self.min_count)
+        self._scale = 1.0
+        self._trie = Trie_Completer(self._weights.keys(), self._weights.values(), self._ignorecase)
+
+    def record(self, word, amount=1.0):
+        """Count word as used amount times, now."""
+        if not word:
+            return
+
+        with self._lock:
+            self._add(word, amount)
+
+            if self.filename is not None:
+                self._pending.append(json.dumps(["+", word, amount]))
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="Usage_Model writer")
+                    self._writer.daemon = True
+                    self._writer.start()
+
+    @property
+    def ignorecase(self):
+        return self._ignorecase
+
+    def count(self, word):
+        with self._lock:
+            return self._weights.get(word, 0.0) / self._scale
+
+    def __getstate__(self):
+        # Copies, such as those sent to worker processes, get the counts but not the log
+        with self._lock:
+            return {"growth": self._growth, "min_count": self.min_count, "ignorecase": self._ignorecase,
+                    "weights": dict((word, weight / self._scale) for word, weight in self._weights.items())}
+
+    def __setstate__(self, state):
+        self.__init__(min_count=state["min_count"], ignorecase=state["ignorecase"])
+        self._growth = state["growth"]
+        self._weights = state["weights"]
+        self._trie = Trie_Completer(self._weights.keys(), self._weights.values(), self._ignorecase)
+
+    def complete(self, prefix, k=None, min_count=0):
+        """Return the used words starting with prefix and counted at least min_count, most used first."""
+        with self._lock:
+            threshold = min_count * self._scale
+            results = []
+            for item, weight in self._trie.iter_complete(prefix):
+                if weight < threshold or k is not None and len(results) >= k:
+                    break
+                results.append(item)
+            return results
+
+    def _write_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Append the recorded words to the log, compacting it once it holds mostly stale lines."""
+        with self._lock:
+            lines, self._pending = self._pending, []
+            compact = self._log_lines + len(lines) > 4 * len(self._weights) + 1000
+            if compact:
+                snapshot = [json.dumps(["=", word, weight / self._scale]) for word, weight in self._weights.items()
+                            if weight / self._scale >= self.min_count]
+
+        if compact:
+            # The snapshot already holds the pending words, and os.replace keeps the old log until it is complete
+            temporary = self.filename + ".tmp"
+            with io.open(temporary, "w", encoding="utf-8") as f:
+                for line in snapshot:
+                    f.write(line + "\n")
+            os.replace(temporary, self.filename)
+            self._log_lines = len(snapshot)
+        elif lines:
+            with io.open(self.filename, "a", encoding="utf-8") as f:
+                for line in lines:
+                    f.write(line + "\n")
+            self._log_lines += len(lines)
+
+    def close(self):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self.filename is not None:
+            self.flush()
+
+
+class Personalized_Completer(object):
+    """Puts the words of a Usage_Model completing the entry ahead of the completions of autocomplete_function.
+
+    Only words counted at least min_count are moved up, so a word used once by
+    accident doesn't displace the dictionary; the others keep their place in it.
+    usage must fold case like autocomplete_function, when that tells its ignorecase.
+    Any other attribute, such as narrow, is looked up on the wrapped function.
+    """
+
+    def __init__(self, autocomplete_function, usage, min_count=1.5):
+        ignorecase = getattr(autocomplete_function, "ignorecase", None)
+        if ignorecase is not None and bool(ignorecase) != bool(usage.ignorecase):
+            raise ValueError("The usage model and the autocomplete function must both ignore case or neither")
+
+        self.autocomplete_function = autocomplete_function
+        self.usage = usage
+        self.min_count = min_count
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["autocomplete_function"], name)
+
+    @staticmethod
+    def _merge(personal, values, k):
+        seen = set(personal)
+        merged = personal + [item for item in values if item not in seen]
+        return merged if k is None else merged[:k]
+
+    def __call__(self, entry_data):
+        return self._merge(self.usage.complete(entry_data, None, self.min_count),
+                           self.autocomplete_function(entry_data), None)
+
+    def complete(self, entry_data, k=None):
+        personal = self.usage.complete(entry_data, k, self.min_count)
+
+        # Enough to still fill k when every personal word is among them
+        values = top_completions(self.autocomplete_function, entry_data, None if k is None else k + len(personal))
+        return self._merge(personal, values, k)
+
+    def complete_many(self, prefixes, k=None):
+        # At most k personal words come first, so 2 * k completions of each prefix always suffice
+        for prefix, values in _complete_sorted(self.autocomplete_function, prefixes, None if k is None else 2 * k):
+            yield prefix, self._merge(self.usage.complete(prefix, k, self.min_count), values, k)
+
+    def iter_matches(self, entry_data):
+        personal = self.usage.complete(entry_data, None, self.min_count)
+        for item in personal:
+            yield item
+
+        iter_matches = getattr(self.autocomplete_function, "iter_matches", None)
+        values = iter_matches(entry_data) if iter_matches is not None else self.autocomplete_function(entry_data)
+
+        seen = set(personal)
+        for item in values:
+            if item not in seen:
+                yield item
+
+
+class Latency_Histogram(object):
+    """Histogram of durations in exponentially growing buckets, from 10 microseconds up to about 20 seconds."""
+
+    MIN_SECONDS = 1e-5
+    GROWTH = 1.2
+    BUCKETS = 80
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(self.BUCKETS - 1, int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1)
+
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding the p-th percentile (p between 0 and 100)."""
+        if not self.count:
+            return 0.0
+
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** bucket)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99), "max": self.max}
+
+
+class Latency_Monitor(object):
+    """Per-keystroke timings of Combobox_Autocomplete, split into lookup and render.
+
+    "keystroke" runs from the entry change to the updated listbox, so in async mode
+    it includes the debounce and the wait for the worker. Every keystroke is also
+    passed to sink as a dict, when one is given.
+    """
+
+    STAGES = ("lookup", "render", "keystroke")
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.histograms = dict((stage, Latency_Histogram()) for stage in self.STAGES)
+
+        self.keystrokes = 0
+        self.empty_results = 0
+        self.total_results = 0
+        self.max_results = 0
+
+    def record(self, lookup, render, keystroke, result_size):
+        self.histograms["lookup"].add(lookup)
+        self.histograms["render"].add(render)
+        self.histograms["keystroke"].add(keystroke)
+
+        self.keystrokes += 1
+        self.total_results += result_size
+        self.max_results = max(self.max_results, result_size)
+        if not result_size:
+            self.empty_results += 1
+
+        if self.sink is not None:
+            self.sink({"lookup": lookup, "render": render, "keystroke": keystroke, "results": result_size})
+
+    def summary(self):
+        summary = dict((stage, histogram.summary()) for stage, histogram in self.histograms.items())
+        summary["results"] = {"keystrokes": self.keystrokes, "empty": self.empty_results,
+                              "mean": float(self.total_results) / self.keystrokes if self.keystrokes else 0.0,
+                              "max": self.max_results}
+        return summary
+
+
 class Combobox_Autocomplete(Entry, object):
+    # Milliseconds between checks for a finished lookup when async_lookup is enabled
+    async_poll_interval = 10
+
+    # Rows rendered above and below the visible ones, so short scrolls don't touch the listbox contents
+    listbox_margin = 20
+
+    # Trie rows a fuzzy lookup may compute before returning what it found, which bounds its latency
+    fuzzy_max_rows = 5000
+
+    # Decayed count from which a used word is ranked above the dictionary
+    usage_min_count = 1.5
+
     def __init__(self, master, list_of_items=None, autocomplete_function=None, listbox_width=None, listbox_height=7,
-                 ignorecase_match=False, startswith_match=True, vscrollbar=True, hscrollbar=True, **kwargs):
+                 ignorecase_match=True, startswith_match=True, vscrollbar=True, hscrollbar=True, async_lookup=False,
+                 debounce_interval=0, executor=None, next_word_model=None, scores=None, max_results=None,
+                 cache_entries=None, cache_bytes=None, max_edit_distance=0, monitor=None, usage=None,
+                 cache_prefix_length=0, **kwargs):
         if hasattr(self, "autocomplete_function"):
             if autocomplete_function is not None:
                 raise ValueError("Autocomplete subclass has 'autocomplete_function' implemented")
@@ -34,44 +1552,63 @@ class Combobox_Autocomplete(Entry, object):
                 if list_of_items is None:
                     raise ValueError("If not guiven complete function, list_of_items can't be 'None'")
 
-                if ignorecase_match:
-                    if startswith_match:
-                        def matches_function(entry_data, item):
-                            return item.startswith(entry_data)
-                    else:
-                        def matches_function(entry_data, item):
-                            return item in entry_data
-
-                    self.autocomplete_function = lambda entry_data: [item for item in self.list_of_items if
-                                                                     matches_function(entry_data, item)]
+                if startswith_match and max_edit_distance:
+                    # Only the trie can walk near misses
+                    self.autocomplete_function = Packed_Trie(list_of_items, scores, ignorecase_match)
+                elif startswith_match:
+                    # Prefixes up to cache_prefix_length get their first listbox window precomputed
+                    self.autocomplete_function = Prefix_Index(list_of_items, ignorecase=ignorecase_match,
+                                                              scores=scores, cache_prefix_length=cache_prefix_length,
+                                                              cache_k=int(listbox_height) + self.listbox_margin)
                 else:
-                    if startswith_match:
-                        def matches_function(escaped_entry_data, item):
-                            if re.match(escaped_entry_data, item, re.IGNORECASE):
-                                return True
-                            else:
-                                return False
-                    else:
-                        def matches_function(escaped_entry_data, item):
-                            if re.search(escaped_entry_data, item, re.IGNORECASE):
-                                return True
-                            else:
-                                return False
-
-                    def autocomplete_function(entry_data):
-                        escaped_entry_data = re.escape(entry_data)
-                        return [item for item in self.list_of_items if matches_function(escaped_entry_data, item)]
-
-                    self.autocomplete_function = autocomplete_function
+                    self.autocomplete_function = Substring_Search(list_of_items, ignorecase=ignorecase_match,
+                                                                  scores=scores)
+
+        if cache_entries is not None or cache_bytes is not None:
+            # An instance attribute also shadows an autocomplete_function defined by a subclass
+            self.autocomplete_function = Cached_Completer(self.autocomplete_function,
+                                                          cache_entries if cache_entries is not None else 1024,
+                                                          cache_bytes)
+
+        # Words accepted or entered are counted in usage, and ranked first once counted usage_min_count
+        self.usage = usage
+        if usage is not None:
+            self.autocomplete_function = Personalized_Completer(self.autocomplete_function, usage,
+                                                                self.usage_min_count)
+
+        self.monitor = monitor
+
+        # When nothing starts with the entry, the engine's fuzzy_complete is asked for near misses
+        if max_edit_distance and getattr(self.autocomplete_function, "fuzzy_complete", None) is None:
+            raise ValueError("max_edit_distance needs an autocomplete_function with fuzzy_complete")
+        self._max_edit_distance = max_edit_distance
+
+        # With a next-word model, only the last word of the entry is completed and
+        # an entry ending in whitespace gets next-word predictions
+        self._next_word_model = next_word_model
+        self._completion_base = ""
 
         self._listbox_height = int(listbox_height)
         self._listbox_width = listbox_width
 
+        # Ranked completions are cut to the best max_results, a listbox worth by default
+        if max_results is None and scores is not None:
+            max_results = self._listbox_height
+        self._max_results = max_results
+
         self.list_of_items = list_of_items
 
         self._use_vscrollbar = vscrollbar
         self._use_hscrollbar = hscrollbar
 
+        # In async mode lookups run on the executor; only the results are handed back to the Tk thread
+        self._async_lookup = async_lookup
+        self._debounce_interval = int(debounce_interval)
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._lookup_generation = 0
+        self._pending_lookup_id = None
+
         kwargs.setdefault("background", "white")
 
         if "textvariable" in kwargs:
@@ -83,7 +1620,12 @@ class Combobox_Autocomplete(Entry, object):
 
         self._trace_id = self._entry_var.trace('w', self._on_change_entry_var)
 
+        # The popup is built on first use and then only placed and hidden
         self._listbox = None
+        self._listbox_posted = False
+
+        # Stack of (entry_data, values) for the chain of prefixes typed so far
+        self._query_cache = []
 
         self.bind("<Tab>", self._on_tab)
         self.bind("<Up>", self._previous)
@@ -103,27 +1645,147 @@ class Combobox_Autocomplete(Entry, object):
         entry_data = self._entry_var.get()
 
         if entry_data == '':
+            self.clear_cache()
             self.unpost_listbox()
             self.focus()
+        elif self._async_lookup:
+            self._schedule_lookup(entry_data, self._debounce_interval)
         else:
-            values = self.autocomplete_function(entry_data)
-            if values:
-                if self._listbox is None:
-                    self._build_listbox(values)
-                else:
-                    self._listbox.delete(0, END)
+            started = time.perf_counter()
+            values, lookup_time = self._timed_compute_values(entry_data)
+            self._present(entry_data, values, started, lookup_time)
 
-                    height = min(self._listbox_height, len(values))
-                    self._listbox.configure(height=height)
+    def _timed_compute_values(self, entry_data):
+        started = time.perf_counter()
+        values = self._compute_values(entry_data)
+        return values, time.perf_counter() - started
 
-                    for item in values:
-                        self._listbox.insert(END, item)
+    def _present(self, entry_data, values, started, lookup_time):
+        render_started = time.perf_counter()
+        self._show_values(entry_data, values)
 
-            else:
-                self.unpost_listbox()
-                self.focus()
+        if self.monitor is not None:
+            finished = time.perf_counter()
+            # Lazy results count the rows pulled so far, not every match
+            size = values.loaded if isinstance(values, Lazy_Results) else len(values)
+            self.monitor.record(lookup_time, finished - render_started, finished - started, size)
+
+    def _split_entry(self, entry_data):
+        if self._next_word_model is None:
+            return "", entry_data
+
+        match = re.search(r"\w*$", entry_data)
+        return entry_data[:match.start()], match.group()
+
+    def _compute_values(self, entry_data):
+        base, query = self._split_entry(entry_data)
+
+        if query:
+            values = self._lookup(query)
+
+            if not values and self._max_edit_distance:
+                values = self.autocomplete_function.fuzzy_complete(query, self._max_edit_distance,
+                                                                   self._max_results or self._listbox_height,
+                                                                   self.fuzzy_max_rows)
+
+            if isinstance(values, Lazy_Results):
+                # Pull the first window here, which is on the executor in async mode
+                values.pull(self._listbox_height + self.listbox_margin)
+            return values
+
+        return self._next_word_model.predict(tokenize(base), self._listbox_height)
+
+    def _show_values(self, entry_data, values):
+        self._completion_base = self._split_entry(entry_data)[0]
+
+        if values:
+            self._post_values(values)
+
+        else:
+            self.unpost_listbox()
+            self.focus()
+
+    def _lookup(self, entry_data):
+        query_cache = self._query_cache
+
+        # Backspacing or editing pops back to the longest cached prefix of the new text
+        while query_cache and not entry_data.startswith(query_cache[-1][0]):
+            query_cache.pop()
 
-    def _build_listbox(self, values):
+        if query_cache and query_cache[-1][0] == entry_data:
+            return query_cache[-1][1]
+
+        narrow = getattr(self.autocomplete_function, "narrow", None)
+
+        # A list cut at max_results may be missing completions of the longer prefix, and
+        # narrowing lazy results would pull them all, so these are looked up again
+        previous = query_cache[-1][1] if query_cache else None
+        if narrow is not None and previous is not None and \
+                (not isinstance(previous, Lazy_Results) or previous.exhausted) and \
+                (self._max_results is None or len(previous) < self._max_results):
+            values = narrow(entry_data, previous)
+        else:
+            values = self._complete(entry_data)
+
+        query_cache.append((entry_data, values))
+        return values
+
+    def _complete(self, entry_data):
+        if self._max_results is None:
+            # Engines that can stream their matches are only pulled as far as the listbox shows
+            iter_matches = getattr(self.autocomplete_function, "iter_matches", None)
+            if iter_matches is not None:
+                return Lazy_Results(iter_matches(entry_data))
+            return self.autocomplete_function(entry_data)
+
+        return top_completions(self.autocomplete_function, entry_data, self._max_results)
+
+    def clear_cache(self):
+        # Rebinding instead of clearing in place keeps a lookup running on the executor consistent
+        self._query_cache = []
+
+    def _cancel_lookup(self):
+        self._lookup_generation += 1
+
+        if self._pending_lookup_id is not None:
+            self.after_cancel(self._pending_lookup_id)
+            self._pending_lookup_id = None
+
+    def _schedule_lookup(self, entry_data, delay):
+        self._cancel_lookup()
+        self._pending_lookup_id = self.after(delay, self._start_lookup, self._lookup_generation, entry_data,
+                                             time.perf_counter())
+
+    def _start_lookup(self, generation, entry_data, started):
+        self._pending_lookup_id = None
+
+        if self._executor is None:
+            # A single worker serializes lookups, so only one thread ever touches the query cache
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+        future = self._executor.submit(self._timed_compute_values, entry_data)
+        self._poll_lookup(generation, entry_data, started, future)
+
+    def _poll_lookup(self, generation, entry_data, started, future):
+        if generation != self._lookup_generation:
+            # The entry changed since this lookup started, so its result is stale
+            future.cancel()
+        elif future.done():
+            values, lookup_time = future.result()
+            self._present(entry_data, values, started, lookup_time)
+        else:
+            self.after(self.async_poll_interval, self._poll_lookup, generation, entry_data, started, future)
+
+    def _post_values(self, values):
+        if self._listbox is None:
+            self._build_listbox()
+
+        self._set_listbox_values(values)
+
+        if not self._listbox_posted:
+            self._place_listbox()
+
+    def _build_listbox(self):
         listbox_frame = Frame()
 
         self._listbox = Listbox(listbox_frame, background="white", selectmode=SINGLE, activestyle="none",
@@ -137,11 +1799,16 @@ class Combobox_Autocomplete(Entry, object):
         self._listbox.bind('<Control-n>', self._next)
         self._listbox.bind('<Control-p>', self._previous)
 
-        if self._use_vscrollbar:
-            vbar = Scrollbar(listbox_frame, orient=VERTICAL, command=self._listbox.yview)
-            vbar.grid(row=0, column=1, sticky=N + S)
+        # The listbox only holds a window of the values, so scrolling is driven from here
+        self._listbox.bind("<MouseWheel>", self._on_mousewheel)
+        self._listbox.bind("<Button-4>", self._on_mousewheel)
+        self._listbox.bind("<Button-5>", self._on_mousewheel)
 
-            self._listbox.configure(yscrollcommand=lambda f, l: autoscroll(vbar, f, l))
+        if self._use_vscrollbar:
+            self._vbar = Scrollbar(listbox_frame, orient=VERTICAL, command=self._on_vscrollbar)
+            self._vbar.grid(row=0, column=1, sticky=N + S)
+        else:
+            self._vbar = None
 
         if self._use_hscrollbar:
             hbar = Scrollbar(listbox_frame, orient=HORIZONTAL, command=self._listbox.xview)
@@ -152,6 +1819,9 @@ class Combobox_Autocomplete(Entry, object):
         listbox_frame.grid_columnconfigure(0, weight=1)
         listbox_frame.grid_rowconfigure(0, weight=1)
 
+        self._rendered_rows = []
+
+    def _place_listbox(self):
         x = -self.cget("borderwidth") - self.cget("highlightthickness")
         y = self.winfo_height() - self.cget("borderwidth") - self.cget("highlightthickness")
 
@@ -160,34 +1830,150 @@ class Combobox_Autocomplete(Entry, object):
         else:
             width = self.winfo_width()
 
-        listbox_frame.place(in_=self, x=x, y=y, width=width)
+        self._listbox.master.place(in_=self, x=x, y=y, width=width)
+        self._listbox_posted = True
 
-        height = min(self._listbox_height, len(values))
-        self._listbox.configure(height=height)
+    def _set_listbox_values(self, values):
+        self._values = values
+        self._selected_index = None
 
-        for item in values:
-            self._listbox.insert(END, item)
+        self._visible_rows = self._available_rows(self._listbox_height)
+        self._listbox.configure(height=self._visible_rows)
+
+        # Force a render of the first rows even if the previous window covered them
+        self._view_start = self._view_stop = 0
+        self._scroll_to(0)
+
+    def _available_rows(self, count):
+        """Return how many of the first count values exist, pulling lazy values only that far."""
+        if isinstance(self._values, Lazy_Results):
+            return self._values.pull(count)
+        return min(count, len(self._values))
+
+    def _render_rows(self, top):
+        self._view_start = max(0, top - self.listbox_margin)
+        self._view_stop = self._available_rows(top + self._visible_rows + self.listbox_margin)
+
+        rows = self._values[self._view_start:self._view_stop]
+        old_rows = self._rendered_rows
+
+        # Only replace the rows between the unchanged head and tail of the window
+        head = 0
+        shortest = min(len(rows), len(old_rows))
+        while head < shortest and rows[head] == old_rows[head]:
+            head += 1
+
+        tail = 0
+        while tail < shortest - head and rows[-1 - tail] == old_rows[-1 - tail]:
+            tail += 1
+
+        self._listbox.selection_clear(0, END)
+
+        if head + tail < len(old_rows):
+            self._listbox.delete(head, len(old_rows) - tail - 1)
+        if head + tail < len(rows):
+            self._listbox.insert(head, *rows[head:len(rows) - tail])
+
+        self._rendered_rows = rows
+
+        if self._selected_index is not None and self._view_start <= self._selected_index < self._view_stop:
+            row = self._selected_index - self._view_start
+            self._listbox.selection_set(row)
+            self._listbox.activate(row)
+
+    def _scroll_to(self, top):
+        pulled = self._available_rows(max(top, 0) + self._visible_rows + self.listbox_margin)
+        if isinstance(self._values, Lazy_Results) and not self._values.exhausted:
+            # Lazy values grow as they are scrolled through, so the scrollbar covers the rows pulled so far
+            total = pulled
+        else:
+            total = len(self._values)
+        top = max(0, min(top, total - self._visible_rows))
+        self._total_rows = total
+
+        if top < self._view_start or top + self._visible_rows > self._view_stop:
+            self._render_rows(top)
+
+        self._listbox.yview(top - self._view_start)
+        self._top_row = top
+
+        if self._vbar is not None:
+            autoscroll(self._vbar, float(top) / total, float(top + self._visible_rows) / total)
+
+    def _on_vscrollbar(self, *args):
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * self._total_rows))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self._visible_rows
+            self._scroll_to(self._top_row + step)
+
+    def _on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self._scroll_to(self._top_row - 3)
+        else:
+            self._scroll_to(self._top_row + 3)
+        return "break"
+
+    def _select(self, index):
+        if self._selected_index is not None and self._view_start <= self._selected_index < self._view_stop:
+            self._listbox.selection_clear(self._selected_index - self._view_start)
+
+        self._selected_index = index
+
+        if index < self._top_row:
+            self._scroll_to(index)
+        elif index >= self._top_row + self._visible_rows:
+            self._scroll_to(index - self._visible_rows + 1)
+
+        row = index - self._view_start
+        self._listbox.selection_set(row)
+        self._listbox.activate(row)
 
     def post_listbox(self):
-        if self._listbox is not None: return
+        if self._listbox_posted: return
 
         entry_data = self._entry_var.get()
         if entry_data == '': return
 
-        values = self.autocomplete_function(entry_data)
+        if self._async_lookup:
+            self._schedule_lookup(entry_data, 0)
+            return
+
+        started = time.perf_counter()
+        values, lookup_time = self._timed_compute_values(entry_data)
         if values:
-            self._build_listbox(values)
+            self._present(entry_data, values, started, lookup_time)
 
     def unpost_listbox(self):
+        self._cancel_lookup()
+
+        if self._listbox_posted:
+            self._listbox.master.place_forget()
+            self._listbox_posted = False
+
+    def destroy(self):
+        self._cancel_lookup()
+
         if self._listbox is not None:
+            # The popup frame belongs to the default root, not to this entry
             self._listbox.master.destroy()
             self._listbox = None
+            self._listbox_posted = False
+
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+        Entry.destroy(self)
 
     def get_value(self):
         return self._entry_var.get()
 
     def set_value(self, text, close_dialog=False):
         self._set_var(text)
+        self._record_usage(self._split_entry(text)[1])
 
         if close_dialog:
             self.unpost_listbox()
@@ -200,72 +1986,141 @@ class Combobox_Autocomplete(Entry, object):
         self._entry_var.set(text)
         self._trace_id = self._entry_var.trace('w', self._on_change_entry_var)
 
+    def _record_usage(self, word):
+        if self.usage is not None and word:
+            self.usage.record(word)
+            # Cached lookups still rank by the old counts
+            self.clear_cache()
+
     def _update_entry_from_listbox(self, event):
-        if self._listbox is not None:
+        self._cancel_lookup()
+        accepted = None
+
+        if self._listbox_posted:
             current_selection = self._listbox.curselection()
 
             if current_selection:
-                text = self._listbox.get(current_selection)
-                self._set_var(text)
+                accepted = self._listbox.get(current_selection)
+            elif self._selected_index is not None:
+                # The selected row was scrolled out of the rendered window
+                accepted = self._values[self._selected_index]
 
-            self._listbox.master.destroy()
-            self._listbox = None
+            if accepted is not None:
+                self._set_var(self._completion_base + accepted)
+
+            self._listbox.master.place_forget()
+            self._listbox_posted = False
 
             self.focus()
             self.icursor(END)
             self.xview_moveto(1.0)
 
+        # Without a selection, Return takes the text as typed
+        if accepted is None:
+            accepted = self._split_entry(self._entry_var.get())[1]
+        self._record_usage(accepted)
+
         return "break"
 
     def _previous(self, event):
-        if self._listbox is not None:
-            current_selection = self._listbox.curselection()
+        if self._listbox_posted:
+            if self._selected_index is None:
+                self._select(0)
+            elif self._selected_index == 0:
+                # Wrapping around to the last row pulls every lazy value
+                self._select(len(self._values) - 1)
+            else:
+                self._select(self._selected_index - 1)
 
-            if len(current_selection) == 0:
-                self._listbox.selection_set(0)
-                self._listbox.activate(0)
+        return "break"
+
+    def _next(self, event):
+        if self._listbox_posted:
+            if self._selected_index is None:
+                self._select(0)
+            elif self._available_rows(self._selected_index + 2) == self._selected_index + 1:
+                self._select(0)
             else:
-                index = int(current_selection[0])
-                self._listbox.selection_clear(index)
+                self._select(self._selected_index + 1)
+        return "break"
 
-                if index == 0:
-                    index = END
-                else:
-                    index -= 1
+def _iter_columns(filename, columns, sep, header):
+    with io.open(filename, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=sep)
 
-                self._listbox.see(index)
-                self._listbox.selection_set(first=index)
-                self._listbox.activate(index)
+        if header:
+            names = next(reader, [])
+            columns = [column if isinstance(column, int) else names.index(column) for column in columns]
+        else:
+            for column in columns:
+                if not isinstance(column, int):
+                    raise ValueError("Column %r can't be selected by name in a file without header" % column)
 
-        return "break"
+        for row in reader:
+            if len(row) > columns[0] and row[columns[0]]:
+                yield [row[column] if len(row) > column else "" for column in columns]
 
-    def _next(self, event):
-        if self._listbox is not None:
 
-            current_selection = self._listbox.curselection()
-            if len(current_selection) == 0:
-                self._listbox.selection_set(0)
-                self._listbox.activate(0)
-            else:
-                index = int(current_selection[0])
-                self._listbox.selection_clear(index)
+def iter_words(filename="word.txt", column="a", sep="\t", header=True):
+    """Yield the non-empty values of one column of a delimited word file, reading it row by row.
 
-                if index == self._listbox.size() - 1:
-                    index = 0
-                else:
-                    index += 1
+    column is a header name, or a 0-based index when the file has no header.
+    """
+    for word, in _iter_columns(filename, [column], sep, header):
+        yield word
 
-                self._listbox.see(index)
-                self._listbox.selection_set(index)
-                self._listbox.activate(index)
-        return "break"
 
+def iter_scored_words(filename="word.txt", column="a", score_column="count", sep="\t", header=True):
+    """Like iter_words, but yield (word, score) pairs with the score read from score_column."""
+    for word, score in _iter_columns(filename, [column, score_column], sep, header):
+        try:
+            yield word, float(score)
+        except ValueError:
+            yield word, 0.0
 
-import pandas as pd
 
-word_list = pd.read_csv(r"word.txt", sep='\t')
-list_of_items = word_list.a.astype(str)
-import re
+def load_word_list(filename="word.txt", column="a", sep="\t", header=True):
+    return list(iter_words(filename, column, sep, header))
+
+
+_JUNK_RE = re.compile(r"^\W*$|[\x00-\x1f\x7f]")
+
+
+def normalize_words(list_of_items, scores=None, merge_case=False):
+    """Strip and dedupe a word list, dropping rows with no word characters or with control characters.
+
+    Exact duplicates keep their first position and their best score. With merge_case,
+    case variants collapse into one item shown in the variant with the best score (or
+    the fewest capitals when scores tie or are missing), scored with their sum.
+    Returns the new (list_of_items, scores), scores being None when none were given.
+    """
+    if scores is None:
+        rows = ((item, 0.0) for item in list_of_items)
+    else:
+        rows = zip(list_of_items, scores)
+
+    # Exact duplicates
+    best_scores = OrderedDict()
+    for item, score in rows:
+        item = item.strip()
+        if _JUNK_RE.search(item):
+            continue
+        if item not in best_scores or score > best_scores[item]:
+            best_scores[item] = score
+
+    if merge_case:
+        variants = OrderedDict()
+        for item, score in best_scores.items():
+            variants.setdefault(item.casefold(), []).append((item, score))
+
+        best_scores = OrderedDict()
+        for group in variants.values():
+            display = max(group, key=lambda variant: (variant[1], -sum(c.isupper() for c in variant[0])))[0]
+            best_scores[display] = sum(score for item, score in group)
+
+    if scores is None:
+        return list(best_scores), None
+    return list(best_scores), list(best_scores.values())
 
 
 def generate_ngrams(list_of_items, n):
@@ -273,1024 +2128,583 @@ def generate_ngrams(list_of_items, n):
     return [" ".join(ngram) for ngram in ngrams]
 
 
-list_of_items = generate_ngrams(list_of_items, n=1)
-list_of_items
-['A',
- 'AA',
- 'aa',
- 'AAA',
- 'aaa',
- 'AAAA',
- 'AAAAAA',
- 'AAAL',
- 'AAAS',
- 'Aaberg',
- 'Aachen',
- 'AAE',
- 'AAEE',
- 'AAF',
- 'AAG',
- 'aah',
- 'aahed',
- 'aahing',
- 'aahs',
- 'AAII',
- 'aal',
- 'Aalborg',
- 'Aalesund',
- 'aalii',
- 'aaliis',
- 'aals',
- 'Aalst',
- 'Aalto',
- 'AAM',
- 'aam',
- 'AAMSI',
- 'Aandahl',
- 'AandR',
- 'Aani',
- 'AAO',
- 'AAP',
- 'AAPSS',
- 'Aaqbiye',
- 'Aar',
- 'Aara',
- 'Aarau',
- 'AARC',
- 'aardvark',
- 'aardvarks',
- 'aardwolf',
- 'aardwolves',
- 'Aaren',
- 'Aargau',
- 'aargh',
- 'Aarhus',
- 'Aarika',
- 'Aaron',
- 'aaron',
- 'Aaronic',
- 'aaronic',
- 'Aaronical',
- 'Aaronite',
- 'Aaronitic',
- 'Aaronsbeard',
- 'Aaronsburg',
- 'Aaronson',
- 'AARP',
- 'aarrgh',
- 'aarrghh',
- 'Aaru',
- 'AAS',
- 'aas',
- 'Aasia',
- 'aasvogel',
- 'aasvogels',
- 'AAU',
- 'AAUP',
- 'AAUW',
- 'AAVSO',
- 'AAX',
- 'Aaxes',
- 'Aaxis',
- 'AB',
- 'AB',
- 'Ab',
- 'ab',
- 'ab',
- 'ABA',
- 'ABA',
- 'Aba',
- 'aba',
- 'Ababa',
- 'Ababdeh',
- 'Ababua',
- 'abac',
- 'abaca',
- 'abacas',
- 'abacate',
- 'abacaxi',
- 'abacay',
- 'abaci',
- 'abacinate',
- 'abacination',
- 'abacisci',
- 'abaciscus',
- 'abacist',
- 'aback',
- 'abacli',
- 'Abaco',
- 'abacot',
- 'abacterial',
- 'abactinal',
- 'abactinally',
- 'abaction',
- 'abactor',
- 'abaculi',
- 'abaculus',
- 'abacus',
- 'abacuses',
- 'Abad',
- 'abada',
- 'Abadan',
- 'Abaddon',
- 'abaddon',
- 'abadejo',
- 'abadengo',
- 'abadia',
- 'Abadite',
- 'abaff',
- 'abaft',
- 'Abagael',
- 'Abagail',
- 'Abagtha',
- 'Abailard',
- 'abaisance',
- 'abaised',
- 'abaiser',
- 'abaisse',
- 'abaissed',
- 'abaka',
- 'Abakan',
- 'abakas',
- 'Abakumov',
- 'abalation',
- 'abalienate',
- 'abalienated',
- 'abalienating',
- 'abalienation',
- 'abalone',
- 'abalones',
- 'Abama',
- 'abamp',
- 'abampere',
- 'abamperes',
- 'abamps',
- 'Abana',
- 'aband',
- 'abandon',
- 'abandonable',
- 'abandoned',
- 'abandonedly',
- 'abandonee',
- 'abandoner',
- 'abandoners',
- 'abandoning',
- 'abandonment',
- 'abandonments',
- 'abandons',
- 'abandum',
- 'abanet',
- 'abanga',
- 'Abanic',
- 'abannition',
- 'Abantes',
- 'abapical',
- 'abaptiston',
- 'abaptistum',
- 'Abarambo',
- 'Abarbarea',
- 'Abaris',
- 'abarthrosis',
- 'abarticular',
- 'abarticulation',
- 'Abas',
- 'abas',
- 'abase',
- 'abased',
- 'abasedly',
- 'abasedness',
- 'abasement',
- 'abasements',
- 'abaser',
- 'abasers',
- 'abases',
- 'Abasgi',
- 'abash',
- 'abashed',
- 'abashedly',
- 'abashedness',
- 'abashes',
- 'abashing',
- 'abashless',
- 'abashlessly',
- 'abashment',
- 'abashments',
- 'abasia',
- 'abasias',
- 'abasic',
- 'abasing',
- 'abasio',
- 'abask',
- 'abassi',
- 'Abassieh',
- 'Abassin',
- 'abastard',
- 'abastardize',
- 'abastral',
- 'abatable',
- 'abatage',
- 'Abate',
- 'abate',
- 'abated',
- 'abatement',
- 'abatements',
- 'abater',
- 'abaters',
- 'abates',
- 'abatic',
- 'abating',
- 'abatis',
- 'abatised',
- 'abatises',
- 'abatjour',
- 'abatjours',
- 'abaton',
- 'abator',
- 'abators',
- 'ABATS',
- 'abattage',
- 'abattis',
- 'abattised',
- 'abattises',
- 'abattoir',
- 'abattoirs',
- 'abattu',
- 'abattue',
- 'Abatua',
- 'abature',
- 'abaue',
- 'abave',
- 'abaxial',
- 'abaxile',
- 'abay',
- 'abayah',
- 'abaze',
- 'abb',
- 'Abba',
- 'abba',
- 'abbacies',
- 'abbacomes',
- 'abbacy',
- 'Abbadide',
- 'Abbai',
- 'abbandono',
- 'abbas',
- 'abbasi',
- 'Abbasid',
- 'abbasid',
- 'abbassi',
- 'Abbassid',
- 'Abbasside',
- 'Abbate',
- 'abbate',
- 'abbatial',
- 'abbatical',
- 'abbatie',
- 'abbaye',
- 'Abbe',
- 'abbe',
- 'abbes',
- 'abbess',
- 'abbesses',
- 'abbest',
- 'Abbevilean',
- 'Abbeville',
- 'Abbevillian',
- 'abbevillian',
- 'Abbey',
- 'abbey',
- 'abbeys',
- 'abbeystead',
- 'abbeystede',
- 'Abbi',
- 'Abbie',
- 'abboccato',
- 'abbogada',
- 'Abbot',
- 'abbot',
- 'abbotcies',
- 'abbotcy',
- 'abbotnullius',
- 'abbotric',
- 'abbots',
- 'Abbotsen',
- 'Abbotsford',
- 'abbotship',
- 'abbotships',
- 'Abbotson',
- 'Abbotsun',
- 'Abbott',
- 'abbott',
- 'Abbottson',
- 'Abbottstown',
- 'Abboud',
- 'abbozzo',
- 'ABBR',
- 'abbr',
- 'abbrev',
- 'abbreviatable',
- 'abbreviate',
- 'abbreviated',
- 'abbreviately',
- 'abbreviates',
- 'abbreviating',
- 'abbreviation',
- 'abbreviations',
- 'abbreviator',
- 'abbreviators',
- 'abbreviatory',
- 'abbreviature',
- 'abbroachment',
- 'Abby',
- 'abby',
- 'Abbye',
- 'Abbyville',
- 'ABC',
- 'abc',
- 'abcess',
- 'abcissa',
- 'abcoulomb',
- 'ABCs',
- 'abd',
- 'abdal',
- 'abdali',
- 'abdaria',
- 'abdat',
- 'Abdel',
- 'AbdelKadir',
- 'AbdelKrim',
- 'Abdella',
- 'Abderhalden',
- 'Abderian',
- 'Abderite',
- 'Abderus',
- 'abdest',
- 'Abdias',
- 'abdicable',
- 'abdicant',
- 'abdicate',
- 'abdicated',
- 'abdicates',
- 'abdicating',
- 'abdication',
- 'abdications',
- 'abdicative',
- 'abdicator',
- 'Abdiel',
- 'abditive',
- 'abditory',
- 'abdom',
- 'abdomen',
- 'abdomens',
- 'abdomina',
- 'abdominal',
- 'Abdominales',
- 'abdominales',
- 'abdominalia',
- 'abdominalian',
- 'abdominally',
- 'abdominals',
- 'abdominoanterior',
- 'abdominocardiac',
- 'abdominocentesis',
- 'abdominocystic',
- 'abdominogenital',
- 'abdominohysterectomy',
- 'abdominohysterotomy',
- 'abdominoposterior',
- 'abdominoscope',
- 'abdominoscopy',
- 'abdominothoracic',
- 'abdominous',
- 'abdominouterotomy',
- 'abdominovaginal',
- 'abdominovesical',
- 'Abdon',
- 'Abdu',
- 'abduce',
- 'abduced',
- 'abducens',
- 'abducent',
- 'abducentes',
- 'abduces',
- 'abducing',
- 'abduct',
- 'abducted',
- 'abducting',
- 'abduction',
- 'abductions',
- 'abductor',
- 'abductores',
- 'abductors',
- 'abducts',
- 'Abdul',
- 'AbdulAziz',
- 'Abdulbaha',
- 'Abdulla',
- 'Abe',
- 'abe',
- 'abeam',
- 'abear',
- 'abearance',
- 'Abebi',
- 'abecedaire',
- 'abecedaria',
- 'abecedarian',
- 'abecedarians',
- 'abecedaries',
- 'abecedarium',
- 'abecedarius',
- 'abecedary',
- 'abed',
- 'abede',
- 'abedge',
- 'Abednego',
- 'abegge',
- 'abeigh',
- 'ABEL',
- 'Abel',
- 'abel',
- 'Abelard',
- 'abele',
- 'abeles',
- 'Abelia',
- 'Abelian',
- 'abelian',
- 'Abelicea',
- 'Abelite',
- 'abelite',
- 'Abell',
- 'Abelmoschus',
- 'abelmosk',
- 'abelmosks',
- 'abelmusk',
- 'Abelonian',
- 'Abelson',
- 'abeltree',
- 'Abencerrages',
- 'abend',
- 'abends',
- 'Abenezra',
- 'abenteric',
- 'Abeokuta',
- 'abepithymia',
- 'ABEPP',
- 'Abercrombie',
- 'Abercromby',
- 'Aberdare',
- 'aberdavine',
- 'Aberdeen',
- 'aberdeen',
- 'Aberdeenshire',
- 'aberdevine',
- 'Aberdonian',
- 'aberduvine',
- 'Aberfan',
- 'Aberglaube',
- 'Aberia',
- 'Abernant',
- 'Abernathy',
- 'abernethy',
- 'Abernon',
- 'aberr',
- 'aberrance',
- 'aberrancies',
- 'aberrancy',
- 'aberrant',
- 'aberrantly',
- 'aberrants',
- 'aberrate',
- 'aberrated',
- 'aberrating',
- 'aberration',
- 'aberrational',
- 'aberrations',
- 'aberrative',
- 'aberrator',
- 'aberrometer',
- 'aberroscope',
- 'Abert',
- 'aberuncate',
- 'aberuncator',
- 'Aberystwyth',
- 'abesse',
- 'abessive',
- 'abet',
- 'abetment',
- 'abetments',
- 'abets',
- 'abettal',
- 'abettals',
- 'abetted',
- 'abetter',
- 'abetters',
- 'abetting',
- 'abettor',
- 'abettors',
- 'Abeu',
- 'abevacuation',
- 'Abey',
- 'abey',
- 'abeyance',
- 'abeyances',
- 'abeyancies',
- 'abeyancy',
- 'abeyant',
- 'abfarad',
- 'abfarads',
- 'ABFM',
- 'Abgatha',
- 'ABHC',
- 'abhenries',
- 'abhenry',
- 'abhenrys',
- 'abhinaya',
- 'abhiseka',
- 'abhominable',
- 'abhor',
- 'abhorred',
- 'abhorrence',
- 'abhorrences',
- 'abhorrency',
- 'abhorrent',
- 'abhorrently',
- 'abhorrer',
- 'abhorrers',
- 'abhorrible',
- 'abhorring',
- 'abhors',
- 'Abhorson',
- 'ABI',
- 'Abia',
- 'Abiathar',
- 'Abib',
- 'abib',
- 'abichite',
- 'abidal',
- 'abidance',
- 'abidances',
- 'abidden',
- 'abide',
- 'abided',
- 'abider',
- 'abiders',
- 'abides',
- 'abidi',
- 'abiding',
- 'abidingly',
- 'abidingness',
- 'Abidjan',
- 'Abie',
- 'abied',
- 'abiegh',
- 'abience',
- 'abient',
- 'Abies',
- 'abies',
- 'abietate',
- 'abietene',
- 'abietic',
- 'abietin',
- 'Abietineae',
- 'abietineous',
- 'abietinic',
- 'abietite',
- 'Abiezer',
- 'Abigael',
- 'Abigail',
- 'abigail',
- 'abigails',
- 'abigailship',
- 'Abigale',
- 'abigeat',
- 'abigei',
- 'abigeus',
- 'Abihu',
- 'Abijah',
- 'abilao',
- 'Abilene',
- 'abilene',
- 'abiliment',
- 'abilitable',
- 'abilities',
- 'ability',
- 'ability',
- 'abilla',
- 'abilo',
- 'Abilyne',
- 'abime',
- 'Abimelech',
- 'Abineri',
- 'Abingdon',
- 'Abinger',
- 'Abington',
- 'Abinoam',
- 'Abinoem',
- 'abintestate',
- 'abiogeneses',
- 'abiogenesis',
- 'abiogenesist',
- 'abiogenetic',
- 'abiogenetical',
- 'abiogenetically',
- 'abiogenist',
- 'abiogenous',
- 'abiogeny',
- 'abiological',
- 'abiologically',
- 'abiology',
- 'abioses',
- 'abiosis',
- 'abiotic',
- 'abiotical',
- 'abiotically',
- 'abiotrophic',
- 'abiotrophy',
- 'Abipon',
- 'Abiquiu',
- 'abir',
- 'abirritant',
- 'abirritate',
- 'abirritated',
- 'abirritating',
- 'abirritation',
- 'abirritative',
- 'Abisag',
- 'Abisha',
- 'Abishag',
- 'Abisia',
- 'abiston',
- 'abit',
- 'Abitibi',
- 'Abiu',
- 'abiuret',
- 'Abixah',
- 'abject',
- 'abjectedness',
- 'abjection',
- 'abjections',
- 'abjective',
- 'abjectly',
- 'abjectness',
- 'abjectnesses',
- 'abjoint',
- 'abjudge',
- 'abjudged',
- 'abjudging',
- 'abjudicate',
- 'abjudicated',
- 'abjudicating',
- 'abjudication',
- 'abjudicator',
- 'abjugate',
- 'abjunct',
- 'abjunction',
- 'abjunctive',
- 'abjuration',
- 'abjurations',
- 'abjuratory',
- 'abjure',
- 'abjured',
- 'abjurement',
- 'abjurer',
- 'abjurers',
- 'abjures',
- 'abjuring',
- 'abkar',
- 'abkari',
- 'abkary',
- 'Abkhas',
- 'Abkhasia',
- 'Abkhasian',
- 'Abkhaz',
- 'Abkhazia',
- 'Abkhazian',
- 'abl',
- 'abl',
- 'ablach',
- 'ablactate',
- 'ablactated',
- 'ablactating',
- 'ablactation',
- 'ablaqueate',
- 'ablare',
- 'Ablast',
- 'ablastemic',
- 'ablastin',
- 'ablastous',
- 'ablate',
- 'ablated',
- 'ablates',
- 'ablating',
- 'ablation',
- 'ablations',
- 'ablatitious',
- 'ablatival',
- 'ablative',
- 'ablatively',
- 'ablatives',
- 'ablator',
- 'ablaut',
- 'ablauts',
- 'ablaze',
- 'able',
- 'able',
- 'ablebodied',
- 'ablebodiedness',
- 'ableeze',
- 'ablegate',
- 'ablegates',
- 'ablegation',
- 'ableminded',
- 'ablemindedness',
- 'ablend',
- 'ableness',
- 'ablepharia',
- 'ablepharon',
- 'ablepharous',
- 'Ablepharus',
- 'ablepsia',
- 'ablepsy',
- 'ableptical',
- 'ableptically',
- 'abler',
- 'ables',
- 'ablesse',
- 'ablest',
- 'ablet',
- 'ablewhackets',
- 'ablings',
- 'ablins',
- 'ablock',
- 'abloom',
- 'ablow',
- 'ABLS',
- 'ablude',
- 'abluent',
- 'abluents',
- 'ablush',
- 'ablute',
- 'abluted',
- 'ablution',
- 'ablutionary',
- 'ablutions',
- 'abluvion',
- 'ably',
- 'ably',
- 'ABM',
- 'abmho',
- 'abmhos',
- 'abmodalities',
- 'abmodality',
- 'abn',
- 'Abnaki',
- 'Abnakis',
- 'abnegate',
- 'abnegated',
- 'abnegates',
- 'abnegating',
- 'abnegation',
- 'abnegations',
- 'abnegative',
- 'abnegator',
- 'abnegators',
- 'Abner',
- 'abner',
- 'abnerval',
- 'abnet',
- 'abneural',
- 'abnormal',
- 'abnormalcies',
- 'abnormalcy',
- 'abnormalise',
- 'abnormalised',
- 'abnormalising',
- 'abnormalism',
- 'abnormalist',
- 'abnormalities',
- 'abnormality',
- 'abnormalize',
- 'abnormalized',
- 'abnormalizing',
- 'abnormally',
- 'abnormalness',
- 'abnormals',
- 'abnormities',
- 'abnormity',
- 'abnormous',
- 'abnumerable',
- 'Abo',
- 'abo',
- 'aboard',
- 'aboardage',
- 'Abobra',
- 'abococket',
- 'abodah',
- 'abode',
- 'aboded',
- 'abodement',
- 'abodes',
- 'aboding',
- 'abody',
- 'abogado',
- 'abogados',
- 'abohm',
- 'abohms',
- 'aboideau',
- 'aboideaus',
- 'aboideaux',
- 'aboil',
- 'aboiteau',
- 'aboiteaus',
- 'aboiteaux',
- 'abolete',
- 'abolish',
- 'abolishable',
- 'abolished',
- 'abolisher',
- 'abolishers',
- 'abolishes',
- 'abolishing',
- 'abolishment',
- 'abolishments',
- 'abolition',
- 'abolitionary',
- 'abolitionise',
- 'abolitionised',
- 'abolitionising',
- 'abolitionism',
- 'abolitionist',
- 'abolitionists',
- 'abolitionize',
- 'abolitionized',
- 'abolitionizing',
- 'abolitions',
- 'abolla',
- 'abollae',
- 'aboma',
- 'abomas',
- 'abomasa',
- 'abomasal',
- 'abomasi',
- 'abomasum',
- 'abomasus',
- 'abomasusi',
- 'Abomb',
- 'abomb',
- 'abominability',
- 'abominable',
- 'abominableness',
- 'abominably',
- 'abominate',
- 'abominated',
- 'abominates',
- 'abominating',
- 'abomination',
- 'abominations',
- 'abominator',
- 'abominators',
- 'abomine',
- 'abondance',
- 'Abongo',
- 'abonne',
- 'abonnement',
- 'aboon',
- 'aborad',
- 'aboral',
- 'aborally',
- 'abord',
- 'Aboriginal',
- 'aboriginal',
- 'aboriginality',
- 'aboriginally',
- 'aboriginals',
- 'aboriginary',
- 'Aborigine',
- 'aborigine',
- 'aborigines',
- 'Abormiri',
- 'Aborn',
- 'aborning',
- 'aborning',
- 'aborsement',
- 'aborsive',
- 'abort',
- 'aborted',
- 'aborter',
- 'aborters',
- 'aborticide',
- 'abortient',
- 'abortifacient',
- 'abortin',
- 'aborting',
- 'abortion',
- 'abortional',
- 'abortionist',
- 'abortionists',
- 'abortions',
- 'abortive',
- 'abortively',
- 'abortiveness',
- 'abortogenic',
- 'aborts',
- 'abortus',
- 'abortuses',
- 'abos',
- 'abote',
- 'Abott',
- 'abouchement',
- 'aboudikro',
- 'abought',
- 'Aboukir',
- 'aboulia',
- 'aboulias',
- 'aboulic',
- 'abound',
- 'abounded',
- 'abounder',
- 'abounding',
- 'aboundingly',
- 'abounds',
- 'Abourezk',
- 'about',
- 'aboutface',
- 'aboutfaced',
- 'aboutfacing',
- 'abouts',
- 'aboutship',
- 'aboutshipped',
- 'aboutshipping',
- 'aboutsledge',
- 'aboutturn',
- 'above',
- 'aboveboard',
- 'aboveboard',
- 'abovecited',
- 'abovedeck',
- 'abovefound',
- 'abovegiven',
- 'aboveground',
- 'abovementioned',
- 'abovementioned',
- 'abovenamed',
- 'aboveproof',
- 'abovequoted',
- 'abovereported',
- 'aboves',
- 'abovesaid',
- 'abovesaid',
- 'abovestairs',
- 'abovewater',
- 'abovewritten',
- 'abow',
- 'abox',
- 'Abp',
- 'abp',
- 'ABPC',
- 'Abqaiq',
- 'abr',
- 'abr',
- 'Abra',
- 'abracadabra',
- 'abrachia',
- 'abrachias',
- 'abradable',
- 'abradant',
- 'abradants',
- 'abrade',
- 'abraded',
- 'abrader',
- 'abraders',
- 'abrades',
- 'abrading',
- 'Abraham',
- 'abraham',
- 'Abrahamic',
- 'Abrahamidae',
- 'Abrahamite',
- 'Abrahamitic',
- 'Abrahamman',
- 'abrahamman',
- 'Abrahams',
- 'Abrahamsen',
- 'Abrahan',
- 'abraid',
- ...]
+_TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+
+
+def tokenize(text):
+    return [token.lower() for token in _TOKEN_RE.findall(text)]
+
+
+class Vocabulary(object):
+    """Interns words as consecutive integer ids, so n-grams can be counted as tuples of small ints."""
+
+    def __init__(self, words=()):
+        self._ids = {}
+        self.words = []
+
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = self._ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def get(self, word, default=None):
+        return self._ids.get(word, default)
+
+    def encode(self, words):
+        return [self.add(word) for word in words]
+
+    def __contains__(self, word):
+        return word in self._ids
+
+    def __len__(self):
+        return len(self.words)
+
+
+def sentence_ngrams(tokens, order, start=None):
+    """Yield every 1- to order-gram ending at each token, with the history padded by start."""
+    history = [start] * (order - 1)
+
+    for token in tokens:
+        for n in range(order):
+            yield tuple(history[len(history) - n:]) + (token,) if n else (token,)
+
+        history.append(token)
+        del history[0]
+
+
+def _count_chunk(args):
+    lines, order = args
+
+    # Ids are local to the chunk; the words list lets count_ngrams translate them
+    vocabulary = Vocabulary([Ngram_Model.SENTENCE_START])
+    counts = Counter()
+    for line in lines:
+        counts.update(sentence_ngrams(vocabulary.encode(tokenize(line)), order, 0))
+    return vocabulary.words, counts
+
+
+def iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_counted_chunks(lines, order, processes, chunk_size):
+    """Yield the (words, counts) of every chunk of chunk_size lines, in order; see count_ngrams."""
+    chunks = ((chunk, order) for chunk in iter_chunks(lines, chunk_size))
+
+    if processes == 1:
+        for chunk in chunks:
+            yield _count_chunk(chunk)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Pool.imap would read the whole input ahead, so cap the chunks in flight instead
+        max_pending = 2 * (processes or multiprocessing.cpu_count())
+        pending = deque()
+
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(_count_chunk, (chunk,)))
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def count_ngrams(lines, order, vocabulary, processes=None, chunk_size=10000, min_count=1):
+    """Count the 1- to order-grams of a stream of lines in chunks of chunk_size lines.
+
+    Chunks are counted in a pool of processes workers (all cores by default, inline
+    when processes is 1) and merged in order, with only a few chunks in flight at
+    once. The result is keyed by tuples of ids from vocabulary, which gets the new
+    words added. N-grams seen fewer than min_count times are dropped.
+    """
+    counts = Counter()
+
+    for words, chunk_counts in _iter_counted_chunks(lines, order, processes, chunk_size):
+        translation = vocabulary.encode(words)
+        for ngram, count in chunk_counts.items():
+            counts[tuple([translation[word_id] for word_id in ngram])] += count
+
+    if min_count > 1:
+        counts = Counter({ngram: count for ngram, count in counts.items() if count >= min_count})
+    return counts
+
+
+# Every word id of a packed n-gram takes this many bits, whatever the order
+_WORD_BITS = 32
+_WORD_MASK = (1 << _WORD_BITS) - 1
+_COLUMN_MASK = (1 << 64) - 1
+
+
+def _pack_ids(ids):
+    # A run of word ids packed into one int, the last word in the low bits
+    key = 0
+    for word_id in ids:
+        key = (key << _WORD_BITS) | word_id
+    return key
+
+
+class _Packed_Counts(object):
+    """Counts of packed int keys of a fixed width in bits, as sorted columns.
+
+    Keys wider than 64 bits are split across several columns, most significant
+    part first, so that the columns still sort in key order and can be searched
+    by narrowing a bisect column by column. A top part of 32 bits or less gets a
+    32-bit column.
+    """
+
+    def __init__(self, width, typecode):
+        self.width = width
+        top = width % 64 or 64
+        self._shifts = list(range(max(width - top, 0), -1, -64))
+        self.columns = [array("I" if top <= 32 else "Q")] + [array("Q") for shift in self._shifts[1:]]
+        self.counts = array(typecode)
+
+    def _parts(self, key):
+        return [key >> shift & _COLUMN_MASK for shift in self._shifts]
+
+    def key(self, i):
+        key = 0
+        for column in self.columns:
+            key = (key << 64) | column[i]
+        return key
+
+    def bisect(self, key):
+        """Return the position of the first key not below key."""
+        columns = self.columns
+        if len(columns) == 1:
+            return bisect_left(columns[0], key)
+
+        parts = self._parts(key)
+        lo, hi = 0, len(self.counts)
+        for column, part in zip(columns[:-1], parts):
+            lo = bisect_left(column, part, lo, hi)
+            hi = bisect_right(column, part, lo, hi)
+        return bisect_left(columns[-1], parts[-1], lo, hi)
+
+    def get(self, key):
+        i = self.bisect(key)
+        return self.counts[i] if i < len(self.counts) and self.key(i) == key else 0
+
+    def append(self, key, count):
+        """Add a key past all the others."""
+        for column, part in zip(self.columns, self._parts(key)):
+            column.append(part)
+        self.counts.append(count)
+
+    def add_sorted(self, items):
+        """Add the counts of the sorted (key, count) items."""
+        counts = self.counts
+        columns = self.columns
+        n = len(counts)
+
+        # Known keys are added to in place; the others are spliced in with a single copy of each column
+        parts = [[key >> shift & _COLUMN_MASK for key, count in items] for shift in self._shifts]
+        new = []
+        if len(columns) == 1:
+            column = columns[0]
+            for j, key in enumerate(parts[0]):
+                i = bisect_left(column, key)
+                if i < n and column[i] == key:
+                    counts[i] += items[j][1]
+                else:
+                    new.append((i, j))
+        else:
+            for j, row in enumerate(zip(*parts)):
+                lo, hi = 0, n
+                for column, part in zip(columns[:-1], row):
+                    lo = bisect_left(column, part, lo, hi)
+                    hi = bisect_right(column, part, lo, hi)
+                i = bisect_left(columns[-1], row[-1], lo, hi)
+                if i < hi and columns[-1][i] == row[-1]:
+                    counts[i] += items[j][1]
+                else:
+                    new.append((i, j))
+
+        if not new:
+            return
+
+        positions = [i for i, j in new]
+        self.columns = [self._splice(column, positions, [part[j] for i, j in new])
+                        for column, part in zip(columns, parts)]
+        self.counts = self._splice(counts, positions, [items[j][1] for i, j in new])
+
+    @staticmethod
+    def _splice(column, positions, values):
+        # A copy of column with each value inserted before the item at its position
+        merged = array(column.typecode)
+        start = 0
+        for i, value in zip(positions, values):
+            merged += column[start:i]
+            merged.append(value)
+            start = i
+        merged += column[start:]
+        return merged
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class _Ngram_Table(object):
+    """Counts of the n-grams of one order, as _Packed_Counts of packed n-grams.
+
+    New counts go to a dict keyed by packed n-gram, which is merged into the
+    columns when it grows past a quarter of them, or when the table is queried.
+    Since the last word takes the low bits, the continuations of a context are
+    one contiguous run of keys, and contexts get their totals in columns alike.
+    """
+
+    def __init__(self, words, buffer_size=1 << 16):
+        self.buffer_size = buffer_size
+
+        self._grams = _Packed_Counts(words * _WORD_BITS, "I")
+        self._contexts = _Packed_Counts((words - 1) * _WORD_BITS, "Q")
+        self._added = {}
+
+    def add(self, key, count=1):
+        added = self._added
+        added[key] = added.get(key, 0) + count
+        if len(added) > self.buffer_size and len(added) > len(self._grams) >> 2:
+            self.merge()
+
+    def add_keys(self, keys):
+        """Count each of keys once."""
+        added = self._added
+        for key in keys:
+            added[key] = added.get(key, 0) + 1
+        if len(added) > self.buffer_size and len(added) > len(self._grams) >> 2:
+            self.merge()
+
+    def merge(self):
+        """Fold the new counts into the columns."""
+        if not self._added:
+            return
+
+        added = sorted(self._added.items())
+        self._added = {}
+
+        context_totals = []
+        for key, count in added:
+            context = key >> _WORD_BITS
+            if context_totals and context_totals[-1][0] == context:
+                context_totals[-1][1] += count
+            else:
+                context_totals.append([context, count])
+
+        self._grams.add_sorted(added)
+        self._contexts.add_sorted(context_totals)
+
+    def prune(self, min_count):
+        """Drop the n-grams counted fewer than min_count times."""
+        self.merge()
+
+        old = self._grams
+        grams = _Packed_Counts(old.width, old.counts.typecode)
+        contexts = _Packed_Counts(self._contexts.width, self._contexts.counts.typecode)
+        last_context = None
+
+        for i, count in enumerate(old.counts):
+            if count < min_count:
+                continue
+            key = old.key(i)
+            grams.append(key, count)
+
+            context = key >> _WORD_BITS
+            if context == last_context:
+                contexts.counts[-1] += count
+            else:
+                contexts.append(context, count)
+                last_context = context
+
+        self._grams, self._contexts = grams, contexts
+
+    def count(self, key):
+        if self._added:
+            self.merge()
+        return self._grams.get(key)
+
+    def total(self, context):
+        if self._added:
+            self.merge()
+        return self._contexts.get(context)
+
+    def continuations(self, context):
+        """Yield (word id, count) for every n-gram continuing the packed context."""
+        if self._added:
+            self.merge()
+        grams = self._grams
+        lo = grams.bisect(context << _WORD_BITS)
+        hi = grams.bisect((context + 1) << _WORD_BITS)
+        last_column, counts = grams.columns[-1], grams.counts
+        for i in range(lo, hi):
+            yield last_column[i] & _WORD_MASK, counts[i]
+
+    def __len__(self):
+        if self._added:
+            self.merge()
+        return len(self._grams)
+
+
+class Ngram_Model(object):
+    """Next-word predictor counting 1- to order-grams, scored with stupid backoff.
+
+    Words are interned in a Vocabulary, and every n-gram is packed into an int
+    key of 32 bits per word id, whatever the order. The counts of each order are
+    kept in an _Ngram_Table.
+    """
+
+    SENTENCE_START = "<s>"
+    MAX_WORDS = 1 << _WORD_BITS
+
+    def __init__(self, order=3, alpha=0.4):
+        if order < 1:
+            raise ValueError("The order of an n-gram model must be at least 1")
+
+        self.order = order
+        self.alpha = alpha
+
+        # The sentence start always gets id 0
+        self.vocabulary = Vocabulary([self.SENTENCE_START])
+
+        # _tables[n] counts the (n + 1)-grams
+        self._tables = [_Ngram_Table(n + 1) for n in range(order)]
+
+    def train(self, lines):
+        """Count the n-grams of an iterable of lines, e.g. an open corpus file, one line at a time."""
+        for line in lines:
+            self.add_sentence(tokenize(line))
+        return self
+
+    def add_sentence(self, tokens):
+        history = [0] * self.order
+        keys = [[] for n in range(self.order)]
+
+        # Each longer n-gram ending at a word adds one more word of history to the high bits
+        for word_id in self._encode(tokens):
+            history.append(word_id)
+            del history[0]
+
+            key = word_id
+            keys[0].append(key)
+            for n in range(1, self.order):
+                key |= history[-1 - n] << (n * _WORD_BITS)
+                keys[n].append(key)
+
+        for table, table_keys in zip(self._tables, keys):
+            table.add_keys(table_keys)
+
+    def add_count(self, ngram, count):
+        """Add count occurrences of ngram, a tuple of context words followed by the predicted word."""
+        self._add_ids(self._encode(ngram), count)
+
+    def _encode(self, words):
+        vocabulary = self.vocabulary
+        # Checked before adding any word, so a failed call leaves the vocabulary as it was
+        if len(vocabulary) + len(words) > self.MAX_WORDS and \
+                len(vocabulary) + len(set(word for word in words if word not in vocabulary)) > self.MAX_WORDS:
+            raise ValueError("An n-gram model holds at most %d words" % self.MAX_WORDS)
+        return vocabulary.encode(words)
+
+    def _add_ids(self, ngram, count):
+        self._tables[len(ngram) - 1].add(_pack_ids(ngram), count)
+
+    def frequency(self, word):
+        """Return how often word was counted, usable as a completion score."""
+        word_id = self.vocabulary.get(word)
+        return 0 if word_id is None else self._tables[0].count(word_id)
+
+    def train_parallel(self, lines, processes=None, chunk_size=10000, min_count=1):
+        """Like train, but the n-grams are counted by a process pool; see count_ngrams.
+
+        Every chunk is merged straight into the model, whose tables spill their
+        buffers into packed columns as they go, so memory follows the size of the
+        model rather than the corpus. Afterwards, n-grams counted fewer than
+        min_count times in all are dropped.
+        """
+        if processes == 1:
+            # Nothing to fan out, and counting in place skips the per-chunk tables
+            self.train(lines)
+        else:
+            tables = self._tables
+
+            for words, counts in _iter_counted_chunks(lines, self.order, processes, chunk_size):
+                translation = self._encode(words)
+                for ngram, count in counts.items():
+                    key = 0
+                    for word_id in ngram:
+                        key = (key << _WORD_BITS) | translation[word_id]
+                    tables[len(ngram) - 1].add(key, count)
+
+        if min_count > 1:
+            for table in self._tables:
+                table.prune(min_count)
+        return self
+
+    def _context_keys(self, words):
+        """Return the packed context key for every order, or None where it holds an unknown word."""
+        history = [0] * (self.order - 1) + [self.vocabulary.get(word) for word in words]
+        history = history[len(history) - (self.order - 1):] if self.order > 1 else []
+
+        keys = [0]
+        for n in range(1, self.order):
+            context = history[len(history) - n:]
+            keys.append(None if None in context else _pack_ids(context))
+        return keys
+
+    def score(self, context_words, word):
+        word_id = self.vocabulary.get(word)
+        if word_id is None:
+            return 0.0
+
+        keys = self._context_keys(context_words)
+        weight = 1.0
+
+        for n in range(self.order - 1, -1, -1):
+            if keys[n] is not None:
+                count = self._tables[n].count((keys[n] << _WORD_BITS) | word_id)
+                if count:
+                    return weight * count / self._tables[n].total(keys[n])
+            weight *= self.alpha
+
+        return 0.0
+
+    def predict(self, context_words, k=10):
+        """Return up to k likely next words after context_words, best first."""
+        keys = self._context_keys(context_words)
+        scores = {}
+        weight = 1.0
+
+        for n in range(self.order - 1, -1, -1):
+            total = self._tables[n].total(keys[n]) if keys[n] is not None else 0
+
+            if total:
+                if len(scores) >= k and weight <= sorted(scores.values(), reverse=True)[k - 1]:
+                    # No word first seen at this or a lower order can beat the current top k
+                    break
+
+                total = float(total)
+                for word_id, count in self._tables[n].continuations(keys[n]):
+                    if word_id not in scores:
+                        scores[word_id] = weight * count / total
+
+            weight *= self.alpha
+
+        words = self.vocabulary.words
+        ranked = sorted(scores, key=lambda word_id: (-scores[word_id], words[word_id]))[:k]
+        return [words[word_id] for word_id in ranked]
+
+
+class Dictionary_Provider(object):
+    """Loads the word list on first use and caches it together with the engines built from it."""
+
+    def __init__(self, filename="word.txt", column="a", sep="\t", header=True, index_filename="word.idx",
+                 score_column=None, cache_prefix_length=3, normalize=True, merge_case=False, cache_k=None):
+        self.filename = filename
+        self.column = column
+        self.score_column = score_column
+        self.sep = sep
+        self.header = header
+        self.index_filename = index_filename
+        self.cache_prefix_length = cache_prefix_length
+        # By default, as many completions per prefix as a default Combobox_Autocomplete pulls for its first window
+        self.cache_k = cache_k if cache_k is not None else 7 + Combobox_Autocomplete.listbox_margin
+        self.normalize = normalize
+        self.merge_case = merge_case
+
+        self._lock = threading.RLock()
+        self._cache = {}
+
+    def _cached(self, key, build):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = build()
+            return self._cache[key]
+
+    def _load(self):
+        if self.score_column is None:
+            list_of_items, scores = load_word_list(self.filename, self.column, self.sep, self.header), None
+        else:
+            rows = list(iter_scored_words(self.filename, self.column, self.score_column, self.sep, self.header))
+            list_of_items, scores = [word for word, score in rows], [score for word, score in rows]
+
+        if self.normalize:
+            list_of_items, scores = normalize_words(list_of_items, scores, self.merge_case)
+        return list_of_items, scores
+
+    @property
+    def list_of_items(self):
+        return self._cached("rows", self._load)[0]
+
+    @property
+    def scores(self):
+        """Scores parallel to list_of_items, or None when there is no score_column."""
+        return self._cached("rows", self._load)[1]
+
+    def prefix_index(self, ignorecase=True):
+        return self._cached(("prefix_index", ignorecase),
+                            lambda: Prefix_Index(self.list_of_items, ignorecase, self.scores,
+                                                 self.cache_prefix_length, self.cache_k))
+
+    def trie(self, ignorecase=True):
+        return self._cached(("trie", ignorecase),
+                            lambda: Packed_Trie(self.list_of_items, self.scores, ignorecase))
+
+    def completion_engine(self):
+        """Return the compiled index when index_filename exists, otherwise a Prefix_Index."""
+        if self.index_filename is not None and os.path.exists(self.index_filename):
+            return self._cached("mmap_index", lambda: Mmap_Index(self.index_filename))
+        return self.prefix_index()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+default_dictionary = Dictionary_Provider()
+
+
+def __getattr__(name):
+    # Keeps the old module-level list_of_items working without loading it at import time
+    if name == "list_of_items":
+        return default_dictionary.list_of_items
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 if __name__ == '__main__':
     try:
         from Tkinter import Tk
     except ImportError:
         from tkinter import Tk
 
-    list_of_items
+    if sys.argv[1:2] == ["--compile"]:
+        compile_index(default_dictionary.list_of_items,
+                      sys.argv[2] if len(sys.argv) > 2 else default_dictionary.index_filename,
+                      default_dictionary.scores, cache_prefix_length=default_dictionary.cache_prefix_length,
+                      cache_k=default_dictionary.cache_k)
+        sys.exit()
+
     root = Tk()
     root.geometry("300x200")
 
-    combobox_autocomplete = Combobox_Autocomplete(root, list_of_items, highlightthickness=1)
+    engine = default_dictionary.completion_engine()
+    usage = Usage_Model(os.path.expanduser("~/.textpredictor_usage.log"), ignorecase=engine.ignorecase)
+    combobox_autocomplete = Combobox_Autocomplete(root, autocomplete_function=engine, usage=usage, highlightthickness=1)
     combobox_autocomplete.pack()
 
     combobox_autocomplete.focus()
 
     root.mainloop()
-
-
@@ -0,0 +1,286 @@
+"""Headless benchmarks for TextPredictor: startup, lookup, typing replay and listbox updates.
+
+Each measurement is printed as one JSON object per line, tagged with the git
+commit, so runs from different commits can be compared with any JSON tool:
+
+    python benchmark.py --sizes 10000,100000 --words word.txt > bench_output.txt
+"""
+
+import sys
+import os
+import json
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import argparse
+
+import TextPredictor
+from TextPredictor import Prefix_Index, Trie_Completer, Packed_Trie, Mmap_Index, Substring_Search, \
+    Combobox_Autocomplete, compile_index, load_word_list
+
+
+class Mock_Listbox(object):
+    """Stands in for the Tk Listbox, keeping the rows in a list and counting the calls that reach it."""
+
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+
+    def _index(self, index):
+        if index == "end":
+            return len(self.rows)
+        return index
+
+    def delete(self, first, last=None):
+        self.calls += 1
+        first = self._index(first)
+        last = first if last is None else self._index(last)
+        del self.rows[first:last + 1]
+
+    def insert(self, index, *items):
+        self.calls += 1
+        index = self._index(index)
+        self.rows[index:index] = items
+
+    def configure(self, **kwargs):
+        self.calls += 1
+
+    def yview(self, *args):
+        self.calls += 1
+
+    def selection_set(self, *args):
+        self.calls += 1
+
+    def selection_clear(self, *args):
+        self.calls += 1
+
+    def activate(self, index):
+        self.calls += 1
+
+
+class Headless_Combobox(object):
+    """The lookup and listbox code of Combobox_Autocomplete, run without a Tk display."""
+
+    listbox_margin = Combobox_Autocomplete.listbox_margin
+
+    _lookup = Combobox_Autocomplete._lookup
+    _complete = Combobox_Autocomplete._complete
+    clear_cache = Combobox_Autocomplete.clear_cache
+
+    _set_listbox_values = Combobox_Autocomplete._set_listbox_values
+    _available_rows = Combobox_Autocomplete._available_rows
+    _render_rows = Combobox_Autocomplete._render_rows
+    _scroll_to = Combobox_Autocomplete._scroll_to
+    _select = Combobox_Autocomplete._select
+
+    def __init__(self, autocomplete_function, listbox_height=7, max_results=None):
+        self.autocomplete_function = autocomplete_function
+        self._listbox_height = listbox_height
+        self._max_results = max_results
+        self._query_cache = []
+
+        self._listbox = Mock_Listbox()
+        self._vbar = None
+        self._rendered_rows = []
+
+    def type_text(self, text):
+        for end in range(1, len(text) + 1):
+            values = self._lookup(text[:end])
+            if values:
+                self._set_listbox_values(values)
+
+
+def synthetic_words(size, seed=0):
+    """Return size pseudo-words with letter frequencies close to English, and Zipf-like scores."""
+    rng = random.Random(seed)
+    letters = "etaoinshrdlcumwfgypbvkjxqz"
+    weights = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8, 2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5,
+               1.0, 0.8, 0.15, 0.15, 0.1, 0.07]
+
+    words = []
+    for i in range(size):
+        length = max(1, min(20, int(rng.gauss(8, 3))))
+        word = "".join(rng.choices(letters, weights, k=length))
+        if rng.random() < 0.1:
+            word = word.capitalize()
+        words.append(word)
+
+    scores = [1.0 / (rank + 1) for rank in range(size)]
+    rng.shuffle(scores)
+    return words, scores
+
+
+def write_word_file(words, filename):
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("a\n")
+        for word in words:
+            f.write(word + "\n")
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+    return {"count": len(samples), "mean": sum(samples) / len(samples), "p50": pick(50), "p95": pick(95),
+            "p99": pick(99), "max": samples[-1]}
+
+
+def sample_prefixes(words, length, count, rng):
+    candidates = [word for word in words if len(word) >= length]
+    return [rng.choice(candidates)[:length] for i in range(count)] if candidates else []
+
+
+def bench_cold_start(words, scores, directory, emit):
+    word_file = os.path.join(directory, "word.txt")
+    index_file = os.path.join(directory, "word.idx")
+    write_word_file(words, word_file)
+
+    elapsed, loaded = timed(load_word_list, word_file)
+    emit("cold_start", stage="load_word_list", seconds=elapsed)
+
+    emit("cold_start", stage="prefix_index", seconds=timed(Prefix_Index, loaded, True, scores)[0])
+    emit("cold_start", stage="prefix_index_cached",
+         seconds=timed(Prefix_Index, loaded, True, scores, cache_prefix_length=3)[0])
+    emit("cold_start", stage="trie", seconds=timed(Trie_Completer, loaded, scores)[0])
+    emit("cold_start", stage="packed_trie", seconds=timed(Packed_Trie, loaded, scores)[0])
+    emit("cold_start", stage="substring_search", seconds=timed(Substring_Search, loaded, True, scores)[0])
+    emit("cold_start", stage="compile_index", seconds=timed(compile_index, loaded, index_file, scores)[0])
+
+    elapsed, index = timed(Mmap_Index, index_file)
+    emit("cold_start", stage="mmap_open", seconds=elapsed)
+    index.close()
+
+    return index_file
+
+
+def build_engines(words, scores, index_file):
+    return [
+        ("prefix_index", Prefix_Index(words, True, scores)),
+        ("prefix_index_cached", Prefix_Index(words, True, scores, cache_prefix_length=3)),
+        ("trie", Trie_Completer(words, scores)),
+        ("packed_trie", Packed_Trie(words, scores)),
+        ("mmap_index", Mmap_Index(index_file)),
+    ]
+
+
+def bench_lookup(words, engines, emit, queries, k):
+    rng = random.Random(1)
+
+    for length in range(1, 7):
+        prefixes = sample_prefixes(words, length, queries, rng)
+        if not prefixes:
+            continue
+
+        for name, engine in engines:
+            samples = []
+            for prefix in prefixes:
+                samples.append(timed(engine.complete, prefix, k)[0])
+            emit("lookup", engine=name, prefix_length=length, k=k, **percentiles(samples))
+
+    substring = Substring_Search(words)
+    for length in (2, 3, 4):
+        fragments = [word[1:1 + length] for word in sample_prefixes(words, length + 1, queries, rng)]
+        samples = [timed(substring.complete, fragment, k)[0] for fragment in fragments]
+        emit("lookup", engine="substring_search", prefix_length=length, k=k, **percentiles(samples))
+
+
+def bench_typing(words, engines, emit, sessions, k):
+    rng = random.Random(2)
+    typed = [rng.choice(words) for i in range(sessions)]
+
+    for name, engine in engines:
+        for max_results in (None, k):
+            combobox = Headless_Combobox(engine, max_results=max_results)
+            samples = []
+            for word in typed:
+                combobox.clear_cache()
+                samples.append(timed(combobox.type_text, word)[0])
+            emit("typing", engine=name, max_results=max_results, listbox_calls=combobox._listbox.calls,
+                 **percentiles(samples))
+
+
+def bench_listbox(words, emit, updates):
+    rng = random.Random(3)
+    index = Prefix_Index(words)
+    result_sets = [index(prefix) for prefix in sample_prefixes(words, 1, updates, rng)]
+
+    combobox = Headless_Combobox(index)
+    samples = [timed(combobox._set_listbox_values, values)[0] for values in result_sets if values]
+    emit("listbox_update", rows_mean=sum(map(len, result_sets)) / len(result_sets),
+         listbox_calls=combobox._listbox.calls, **percentiles(samples))
+
+    values = max(result_sets, key=len)
+    combobox._set_listbox_values(values)
+    samples = []
+    for i in range(min(len(values), 500)):
+        samples.append(timed(combobox._select, i)[0])
+    emit("listbox_scroll", rows=len(values), **percentiles(samples))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(TextPredictor.__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma separated sizes of the synthetic dictionaries")
+    parser.add_argument("--words", action="append", default=[], help="real word file(s) to benchmark as well")
+    parser.add_argument("--queries", type=int, default=200, help="prefixes timed per prefix length")
+    parser.add_argument("--sessions", type=int, default=100, help="words typed in the replay scenario")
+    parser.add_argument("-k", type=int, default=7, help="completions requested per lookup")
+    parser.add_argument("--output", help="append the results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "a") if args.output else sys.stdout
+    commit = git_commit()
+
+    dictionaries = [("synthetic-%d" % int(size), int(size)) for size in args.sizes.split(",") if size]
+    dictionaries += [(filename, None) for filename in args.words]
+
+    directory = tempfile.mkdtemp()
+    try:
+        for name, size in dictionaries:
+            if size is None:
+                words = load_word_list(name)
+                scores = None
+            else:
+                words, scores = synthetic_words(size)
+
+            def emit(scenario, **fields):
+                record = {"commit": commit, "python": sys.version.split()[0], "dictionary": name,
+                          "words": len(words), "scenario": scenario}
+                record.update(fields)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+            index_file = bench_cold_start(words, scores, directory, emit)
+            engines = build_engines(words, scores, index_file)
+
+            bench_lookup(words, engines, emit, args.queries, args.k)
+            bench_typing(words, engines, emit, args.sessions, args.k)
+            bench_listbox(words, emit, args.queries)
+
+            for name, engine in engines:
+                if isinstance(engine, Mmap_Index):
+                    engine.close()
+    finally:
+        shutil.rmtree(directory)
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
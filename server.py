@@ -0,0 +1,211 @@
+"""Headless completion server for TextPredictor, speaking JSON lines over a local TCP or Unix socket.
+
+Every request is one JSON object per line and gets one response line with the same id:
+
+    {"id": 1, "prefix": "ab", "k": 5}             ->  {"id": 1, "results": ["about", ...]}
+    {"id": 2, "prefixes": ["ab", "th"], "k": 5}   ->  {"id": 2, "results": [[...], [...]]}
+    {"cancel": 1}                                 ->  {"id": 1, "cancelled": true}, unless already answered
+
+Clients may pipeline requests without waiting for the responses, which come back
+in request order. Requests that queue up on a connection are looked up together
+in one batch on a worker thread, so the event loop keeps reading meanwhile.
+"""
+
+import sys
+import os
+import json
+import asyncio
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from TextPredictor import Dictionary_Provider, complete_many, top_completions
+
+
+def _request_key(request_id):
+    # Ids may be any JSON value, lists included, so compare them in their JSON form
+    return json.dumps(request_id, sort_keys=True)
+
+
+async def _read_line(reader):
+    """Return the next line, b"" at the end, or None for a line over the reader's limit, which is skipped."""
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as error:
+        # The last line may lack its newline
+        return error.partial
+    except asyncio.LimitOverrunError:
+        pass
+
+    while True:
+        try:
+            await reader.readuntil(b"\n")
+            return None
+        except asyncio.LimitOverrunError as error:
+            await reader.readexactly(error.consumed)
+        except asyncio.IncompleteReadError:
+            return None
+
+
+class Completion_Server(object):
+    def __init__(self, autocomplete_function, default_k=10, max_batch=256, workers=1, max_line=1 << 24):
+        self.autocomplete_function = autocomplete_function
+        self.default_k = default_k
+        self.max_batch = max_batch
+        # Longer request lines get an error instead of being read
+        self.max_line = max_line
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _run_batch(self, requests):
+        responses = []
+        for request in requests:
+            try:
+                k = int(request.get("k", self.default_k))
+                if k < 0:
+                    raise ValueError("k must not be negative")
+
+                if "prefixes" in request:
+                    prefixes = request["prefixes"]
+                    if not isinstance(prefixes, list) or not all(isinstance(prefix, str) for prefix in prefixes):
+                        raise TypeError("prefixes must be a list of strings")
+                    found = dict(complete_many(self.autocomplete_function, prefixes, k))
+                    results = [found[prefix] for prefix in prefixes]
+                else:
+                    if not isinstance(request["prefix"], str):
+                        raise TypeError("prefix must be a string")
+                    results = top_completions(self.autocomplete_function, request["prefix"], k)
+                responses.append({"id": request.get("id"), "results": results})
+            except Exception as error:
+                # One request failing, even on an engine bug, must not lose the others of the batch
+                responses.append({"id": request.get("id"), "error": "bad request: %s" % error})
+        return responses
+
+    async def handle_connection(self, reader, writer):
+        queue = asyncio.Queue()
+        # Keys of the requests not answered yet, and of those among them to cancel
+        pending = Counter()
+        cancelled = set()
+        worker = asyncio.ensure_future(self._answer(queue, pending, cancelled, writer))
+
+        try:
+            while True:
+                line = await _read_line(reader)
+                if line is None:
+                    await queue.put(("error", {"id": None,
+                                               "error": "bad request: line longer than %d bytes" % self.max_line}))
+                    continue
+                if not line:
+                    break
+
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("a request must be a JSON object")
+                except (ValueError, RecursionError) as error:
+                    await queue.put(("error", {"id": None, "error": "bad request: %s" % error}))
+                    continue
+
+                if "cancel" in request:
+                    if pending[_request_key(request["cancel"])]:
+                        cancelled.add(_request_key(request["cancel"]))
+                else:
+                    pending[_request_key(request.get("id"))] += 1
+                    await queue.put(("request", request))
+
+            # The client finished sending, maybe only half-closing: answer what is queued, then close
+            await queue.put(None)
+            await worker
+        except ConnectionError:
+            pass
+        finally:
+            # The connection broke: drop whatever is still queued for it
+            if not worker.done():
+                worker.cancel()
+                try:
+                    await worker
+                except (asyncio.CancelledError, ConnectionError):
+                    pass
+            writer.close()
+
+    async def _answer(self, queue, pending, cancelled, writer):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            requests = [await queue.get()]
+            while not queue.empty() and len(requests) < self.max_batch:
+                requests.append(queue.get_nowait())
+
+            # None is queued after the last request
+            finished = requests[-1] is None
+            if finished:
+                requests.pop()
+
+            responses = []
+            lookups = []
+            for kind, request in requests:
+                if kind == "error":
+                    responses.append(request)
+                elif _request_key(request.get("id")) in cancelled:
+                    cancelled.discard(_request_key(request.get("id")))
+                    responses.append({"id": request.get("id"), "cancelled": True})
+                else:
+                    responses.append(None)
+                    lookups.append(request)
+
+            if lookups:
+                answers = iter(await loop.run_in_executor(self._executor, self._run_batch, lookups))
+                responses = [response if response is not None else next(answers) for response in responses]
+
+            for (kind, request), response in zip(requests, responses):
+                if kind == "request":
+                    key = _request_key(request.get("id"))
+                    # A cancel that arrived while the batch was running still wins
+                    if "results" in response and key in cancelled:
+                        cancelled.discard(key)
+                        response = {"id": response["id"], "cancelled": True}
+
+                    pending[key] -= 1
+                    if not pending[key]:
+                        del pending[key]
+                        cancelled.discard(key)
+
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+
+            if finished:
+                return
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=path, limit=self.max_line)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, limit=self.max_line)
+
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--words", default="word.txt", help="word file to serve")
+    parser.add_argument("--index", default="word.idx", help="compiled index to use when it exists")
+    parser.add_argument("-k", type=int, default=10, help="completions per prefix when a request gives no k")
+    args = parser.parse_args(argv)
+
+    dictionary = Dictionary_Provider(args.words, index_filename=args.index)
+    server = Completion_Server(dictionary.completion_engine(), default_k=args.k)
+
+    if args.unix and os.path.exists(args.unix):
+        os.unlink(args.unix)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        sys.exit()
+
+
+if __name__ == '__main__':
+    main()